@@ -1,15 +1,134 @@
 # System imports
+from concurrent.futures import ThreadPoolExecutor
+import base64
 import hashlib
+import hmac
+import os
+import threading
 # Libs imports
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+# Local imports
+from cache import LRUCache
 
+# legacy format, only decrypted (see reencrypt_legacy in db/migrations.py)
 f = Fernet(b'7Uzv2ECpEFXcYUU-7nJWA5n9LptOTa1w9lMNdlkQOUM=')
+# envelopes: version byte, nonce, AES-256-GCM ciphertext and tag (29 bytes more than the text)
+ENVELOPE_VERSION = b'\x01'
+ENVELOPE_NONCE_SIZE = 12
+aesgcm = AESGCM(base64.urlsafe_b64decode(b'9qLmFvnC2tJIHOibfZkpsS9hNP2aNRUJYboWrIvPNZM='))
+# key of the blind indexes, must stay distinct from the encryption key
+BLIND_INDEX_KEY = b'q5Jt0vYwZ4mR8sXn2LkE7pUd9cHa3GbF6TzW1oNiVyQ'
 
-def encrypt(text: str):
-    return f.encrypt(text.encode())
+# decrypted values keyed by their ciphertext, disabled unless enable_decrypt_cache is called
+decrypt_cache: LRUCache = None
 
-def decrypt(text: str):
-    return f.decrypt(text).decode()
+def enable_decrypt_cache(max_entries: int, max_bytes: int):
+    """
+    Memoize decrypt, bounded by a number of entries and a total size in bytes
+    """
+    global decrypt_cache
+    decrypt_cache = LRUCache(
+        max_entries=max_entries,
+        max_bytes=max_bytes,
+        sizeof=lambda token, text: len(token) + len(text)
+    )
+
+def disable_decrypt_cache():
+    global decrypt_cache
+    decrypt_cache = None
+
+def clear_decrypt_cache():
+    """
+    Forget every decrypted value, to call when the encryption key rotates
+    """
+    if decrypt_cache is not None:
+        decrypt_cache.clear()
+
+def decrypt_cache_stats():
+    return decrypt_cache.stats() if decrypt_cache is not None else None
+
+def encrypt(text: str) -> bytes:
+    """
+    Envelope of text, the version byte is authenticated with the ciphertext
+    """
+    nonce = os.urandom(ENVELOPE_NONCE_SIZE)
+    return ENVELOPE_VERSION + nonce + aesgcm.encrypt(nonce, text.encode(), ENVELOPE_VERSION)
+
+def is_legacy(token: bytes) -> bool:
+    """
+    Whether token is a Fernet token (they start with gAAAAA) rather than an envelope
+    """
+    return token[:1] != ENVELOPE_VERSION
+
+def _decrypt(token: bytes) -> str:
+    if is_legacy(token):
+        return f.decrypt(token).decode()
+    nonce = token[1:1 + ENVELOPE_NONCE_SIZE]
+    return aesgcm.decrypt(nonce, token[1 + ENVELOPE_NONCE_SIZE:], ENVELOPE_VERSION).decode()
+
+def decrypt(text: bytes):
+    if decrypt_cache is None:
+        return _decrypt(text)
+    decrypted = decrypt_cache.get(text)
+    if decrypted is None:
+        decrypted = _decrypt(text)
+        decrypt_cache.set(text, decrypted)
+    return decrypted
+
+# batches larger than this are split over the crypt thread pool
+PARALLEL_THRESHOLD = int(os.environ.get("CRYPT_PARALLEL_THRESHOLD", 512))
+POOL_WORKERS = int(os.environ.get("CRYPT_POOL_WORKERS", os.cpu_count() or 1))
+pool: ThreadPoolExecutor = None
+# the route handlers run in threads, only one of them creates the pool
+pool_lock = threading.Lock()
+
+def _map(function, values: list) -> list:
+    """
+    Apply function to every value, over the thread pool for large batches
+    """
+    global pool
+    if len(values) < PARALLEL_THRESHOLD or POOL_WORKERS < 2:
+        return [function(value) for value in values]
+    if pool is None:
+        with pool_lock:
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="crypt")
+    chunk_size = -(-len(values) // POOL_WORKERS)
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    results = pool.map(lambda chunk: [function(value) for value in chunk], chunks)
+    return [result for chunk in results for result in chunk]
+
+def encrypt_many(texts: list) -> list:
+    """
+    Encrypt a column of values, None values are kept as is.\n
+    Equal values are not deduplicated: each one gets its own token
+    so that the ciphertexts don't reveal which rows are equal.
+    """
+    return _map(lambda text: encrypt(text) if text is not None else None, texts)
+
+def decrypt_many(tokens: list) -> list:
+    """
+    Decrypt a column of tokens, None values are kept as is.\n
+    Each distinct token is decrypted once.
+    """
+    distinct = list({token for token in tokens if token is not None})
+    decrypted = dict(zip(distinct, _map(decrypt, distinct)))
+    return [decrypted[token] if token is not None else None for token in tokens]
 
 def hash_password(password: str):
     return hashlib.sha256(f'{password}'.encode('utf-8')).hexdigest()
+
+def blind_index(text: str):
+    """
+    Deterministic keyed hash of a value, used to look up an encrypted
+    column (envelopes are random) with an indexed equality query.
+    """
+    normalized = text.strip().lower()
+    return hmac.new(BLIND_INDEX_KEY, normalized.encode(), hashlib.sha256).hexdigest()
+
+if int(os.environ.get("DECRYPT_CACHE_MAX_ENTRIES", 0)) > 0:
+    enable_decrypt_cache(
+        max_entries=int(os.environ["DECRYPT_CACHE_MAX_ENTRIES"]),
+        max_bytes=int(os.environ.get("DECRYPT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    )
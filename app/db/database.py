@@ -1,12 +1,75 @@
-from sqlalchemy import create_engine
+# System imports
+import os
+# Libs imports
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./db/companyplus.db"
+SQLALCHEMY_DATABASE_URL = os.environ.get(
+    "SQLALCHEMY_DATABASE_URL", "sqlite:///./db/companyplus.db")
+# "tuned" applies the SQLite pragmas below on every new connection, "plain" leaves SQLite defaults
+SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "tuned")
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+# negative values are in KiB
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", -64000))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SQLITE_PRAGMAS = [
+    # readers don't block the writer and the writer doesn't block readers
+    "journal_mode=WAL",
+    # durable at checkpoints, safe from corruption in WAL mode
+    "synchronous=NORMAL",
+    # wait for the lock instead of failing with "database is locked"
+    f"busy_timeout={SQLITE_BUSY_TIMEOUT}",
+    f"mmap_size={SQLITE_MMAP_SIZE}",
+    f"cache_size={SQLITE_CACHE_SIZE}",
+    "temp_store=MEMORY",
+]
 
-Base = declarative_base() 
\ No newline at end of file
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+
+def create_db_engine(url: str):
+    """
+    Engine of the database url, with a connection pool and,
+    for a SQLite file, the pragmas of the SQLITE_PROFILE
+    """
+    database_url = make_url(url)
+    if database_url.get_backend_name() != "sqlite":
+        return create_engine(url, pool_size=DB_POOL_SIZE,
+                             max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
+
+    if database_url.database in (None, "", ":memory:"):
+        # a memory database only lives in its connection, keep SQLAlchemy's pool
+        return create_engine(url, connect_args={"check_same_thread": False})
+
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False,
+                      "timeout": SQLITE_BUSY_TIMEOUT / 1000},
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+    )
+    if SQLITE_PROFILE == "tuned":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+# the objects of a request stay loaded after its commit, the routes
+# answer with them instead of refreshing them from the database
+SessionLocal = sessionmaker(autocommit=False, autoflush=False,
+                            expire_on_commit=False, bind=engine)
+
+Base = declarative_base()
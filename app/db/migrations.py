@@ -0,0 +1,240 @@
+# System imports
+import datetime
+# Libs imports
+from sqlalchemy import DateTime, LargeBinary, String, bindparam, case, func, insert, inspect, literal, select, text
+from sqlalchemy.orm import Session
+# Local imports
+from db.database import Base, SessionLocal
+from entities import User as UserEntity, UserEvent as UserEventEntity, Event as EventEntity, Planning as PlanningEntity, Company as CompanyEntity, Tombstone as TombstoneEntity
+from crypt import decrypt_many, encrypt_many, blind_index, is_legacy
+
+BACKFILL_CHUNK_SIZE = 500
+# rows re-encrypted per transaction by reencrypt_legacy
+REENCRYPT_CHUNK_SIZE = 1000
+
+ENCRYPTED_COLUMNS = [
+    (UserEntity, ["first_name", "last_name", "email"]),
+    (CompanyEntity, ["name", "website", "city", "country"]),
+    (PlanningEntity, ["name"]),
+    (EventEntity, ["name", "place"]),
+]
+
+
+def add_missing_columns(engine):
+    """
+    create_all only creates missing tables, add the columns
+    declared in entities.py that an existing database doesn't have yet
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = [column["name"] for column in inspector.get_columns(table.name)]
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def convert_encrypted_columns(engine):
+    """
+    Encrypted columns created as varchar (Fernet tokens were text) become bytea
+    on PostgreSQL, their tokens being kept as their UTF-8 bytes.\n
+    SQLite stores bytes in any column, its columns are kept.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for entity, names in ENCRYPTED_COLUMNS:
+            table = entity.__tablename__
+            if not inspector.has_table(table):
+                continue
+            types = {column["name"]: column["type"] for column in inspector.get_columns(table)}
+            for name in names:
+                if name not in types or isinstance(types[name], LargeBinary):
+                    continue
+                connection.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN {name} TYPE bytea USING convert_to({name}, 'UTF8')"))
+
+
+def dedupe_user_event(engine):
+    """
+    Keep a single row per (event_id, user_id) in user_event, so that
+    its unique index can be created: the oldest row is kept, accepted
+    if any of the duplicates was, and the others get a tombstone
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(UserEventEntity.__tablename__):
+        return
+    index_names = [index["name"] for index in inspector.get_indexes(UserEventEntity.__tablename__)]
+    if "ux_user_event_event_id_user_id" in index_names:
+        return
+
+    table = UserEventEntity.__table__
+    events = EventEntity.__table__
+    plannings = PlanningEntity.__table__
+    pairs = (
+        select(func.min(table.c.id))
+        .where(table.c.event_id != None, table.c.user_id != None)
+        .group_by(table.c.event_id, table.c.user_id)
+    )
+    duplicates = select(table.c.id).where(
+        table.c.event_id != None, table.c.user_id != None, table.c.id.notin_(pairs))
+    with engine.begin() as connection:
+        duplicate_ids = connection.execute(duplicates).scalars().all()
+        if not duplicate_ids:
+            return
+        # MAX of a boolean isn't defined on PostgreSQL
+        accepted_pairs = pairs.having(func.count() > 1).having(
+            func.max(case((table.c.accepted == True, 1), else_=0)) == 1)
+        connection.execute(table.update().where(
+            table.c.id.in_(accepted_pairs)).values(accepted=True))
+        connection.execute(insert(TombstoneEntity.__table__).from_select(
+            ["entity", "entity_id", "company_id", "deleted_at"],
+            select(
+                literal("user_event", String),
+                table.c.id,
+                plannings.c.company_id,
+                literal(datetime.datetime.utcnow(), DateTime),
+            )
+            .select_from(table
+                         .join(events, events.c.id == table.c.event_id)
+                         .outerjoin(plannings, plannings.c.id == events.c.planning_id))
+            .where(table.c.id.in_(duplicate_ids))
+        ))
+        connection.execute(table.delete().where(table.c.id.in_(duplicate_ids)))
+
+
+def create_missing_indexes(engine):
+    """
+    Create the indexes declared in entities.py that an existing database doesn't have yet
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def check_email_collisions(db: Session):
+    """
+    The email blind index ignores case and surrounding spaces and is unique:
+    fail with the ids of the users whose emails only differ by them,
+    to be fixed by hand before the index is backfilled
+    """
+    users = db.query(UserEntity.id, UserEntity.email, UserEntity.email_index).filter(
+        UserEntity.email != None).all()
+    emails = decrypt_many([user.email for user in users])
+    users_by_index = dict()
+    for user, email in zip(users, emails):
+        users_by_index.setdefault(
+            user.email_index or blind_index(email), []).append(user.id)
+    collisions = [ids for ids in users_by_index.values() if len(ids) > 1]
+    if collisions:
+        raise RuntimeError(
+            "These users have the same email up to case or surrounding spaces, "
+            "change their emails before starting the API (user ids): "
+            + "; ".join(", ".join(str(id) for id in ids) for ids in collisions))
+
+
+def backfill_email_index(db: Session):
+    """
+    Compute the email blind index of the users created before it existed,
+    their updated_at is kept: they don't change
+    """
+    if db.query(UserEntity.id).filter(UserEntity.email_index == None).first() == None:
+        return
+    check_email_collisions(db)
+    table = UserEntity.__table__
+    update = (
+        table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(email_index=bindparam("email_index"), updated_at=table.c.updated_at)
+    )
+    while True:
+        users = db.execute(
+            select(table.c.id, table.c.email)
+            .where(table.c.email_index == None)
+            .limit(BACKFILL_CHUNK_SIZE)
+        ).all()
+        if not users:
+            break
+        emails = decrypt_many([user.email for user in users])
+        db.execute(update, [
+            dict(row_id=user.id, email_index=blind_index(email))
+            for user, email in zip(users, emails)
+        ])
+        db.commit()
+
+
+def reencrypt_legacy(db: Session, chunk_size: int = REENCRYPT_CHUNK_SIZE) -> dict:
+    """
+    Rewrite the legacy Fernet tokens of the encrypted columns in the envelope
+    format, chunk_size rows per transaction, returns the number of rewritten rows per table.\n
+    The rows are locked while they are rewritten and their updated_at is kept:
+    their values don't change. It can be stopped and run again at any time.
+    """
+    counts = dict()
+    for entity, names in ENCRYPTED_COLUMNS:
+        table = entity.__table__
+        columns = [table.c[name] for name in names]
+        update = (
+            table.update()
+            .where(table.c.id == bindparam("row_id"))
+            .values(updated_at=table.c.updated_at,
+                    **{name: bindparam(name) for name in names})
+        )
+        counts[table.name] = 0
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(table.c.id, *columns)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(chunk_size)
+                .with_for_update()
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            legacy_rows = [row for row in rows if any(
+                row._mapping[name] != None and is_legacy(row._mapping[name]) for name in names)]
+            if legacy_rows:
+                values = dict()
+                for name in names:
+                    values[name] = encrypt_many(decrypt_many(
+                        [row._mapping[name] for row in legacy_rows]))
+                db.execute(update, [
+                    dict(row_id=row.id, **{name: values[name][i] for name in names})
+                    for i, row in enumerate(legacy_rows)
+                ])
+                counts[table.name] += len(legacy_rows)
+            db.commit()
+    return counts
+
+
+def upgrade(engine):
+    """
+    Bring an existing database up to date with entities.py
+    """
+    add_missing_columns(engine)
+    convert_encrypted_columns(engine)
+    dedupe_user_event(engine)
+    create_missing_indexes(engine)
+    db = SessionLocal(bind=engine)
+    try:
+        backfill_email_index(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # python -m db.migrations, from the app directory
+    db = SessionLocal()
+    try:
+        counts = reencrypt_legacy(db)
+    finally:
+        db.close()
+    print("re-encrypted rows: " + ", ".join(f"{table}={count}" for table, count in counts.items()))
@@ -1,3 +1,4 @@
+from fastapi import Request
 from db.database import SessionLocal
 
 def get_db():
@@ -5,4 +6,11 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_body(request: Request) -> bytes:
+    """
+    Raw request body, read on the event loop so that the route can be a plain def
+    """
+    return await request.body()
@@ -1,24 +1,41 @@
 # System imports
 import datetime
 # Libs imports
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
-from sqlalchemy.types import DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, LargeBinary, String
+from sqlalchemy.types import DateTime, TypeDecorator
 from sqlalchemy.orm import relationship
 
 from db.database import Base
 
 
+# encrypted value (see crypt.py), stored as a BLOB
+class Ciphertext(TypeDecorator):
+    impl = LargeBinary
+    cache_ok = True
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            # legacy Fernet tokens were stored as text
+            if isinstance(value, str):
+                return value.encode()
+            return bytes(value) if value != None else None
+        return process
+
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    first_name = Column(String)
-    last_name = Column(String)
-    email = Column(String, unique=True)
+    first_name = Column(Ciphertext)
+    last_name = Column(Ciphertext)
+    email = Column(Ciphertext, unique=True)
+    # blind index of the email (see crypt.blind_index)
+    email_index = Column(String, unique=True, index=True)
     password_hash = Column(String)
     role = Column(String)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=True)
     company = relationship("Company", back_populates="users")
     events = relationship("Event", back_populates="users")
@@ -29,12 +46,13 @@ class Company(Base):
     __tablename__ = "companies"
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True)
-    website = Column(String, nullable=True)
-    city = Column(String, nullable=True)
-    country = Column(String, nullable=True)
+    name = Column(Ciphertext, unique=True)
+    website = Column(Ciphertext, nullable=True)
+    city = Column(Ciphertext, nullable=True)
+    country = Column(Ciphertext, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow, index=True)
     users = relationship("User", back_populates="company")
     plannings = relationship("Planning", back_populates="company")
 
@@ -43,10 +61,11 @@ class Planning(Base):
     __tablename__ = "plannings"
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True)
+    name = Column(Ciphertext, unique=True)
     company_id = Column(Integer, ForeignKey("companies.id"))
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow, index=True)
     company = relationship("Company", back_populates="plannings")
     events = relationship("Event", back_populates="planning")
 
@@ -55,17 +74,25 @@ class Event(Base):
     __tablename__ = "events"
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String)
-    place = Column(String)
+    name = Column(Ciphertext)
+    place = Column(Ciphertext)
     start_date = Column(DateTime, default=datetime.datetime.utcnow)
     end_date = Column(DateTime, default=datetime.datetime.utcnow)
     planning_id = Column(Integer, ForeignKey("plannings.id"))
     owner_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow, index=True)
     planning = relationship("Planning", back_populates="events")
     users = relationship("User", back_populates="events")
 
+    __table_args__ = (
+        # events of a planning in a time range
+        Index("ix_events_planning_id_start_date", "planning_id", "start_date"),
+        # events overlapping a time range
+        Index("ix_events_start_date_end_date", "start_date", "end_date"),
+    )
+
 # relation table
 class UserEvent(Base):
     __tablename__ = "user_event"
@@ -75,7 +102,15 @@ class UserEvent(Base):
     event_id = Column(Integer, ForeignKey("events.id"))
     accepted = Column(Boolean, default=False)
     added_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # a user is in an event once, attendees of an event
+        Index("ux_user_event_event_id_user_id", "event_id", "user_id", unique=True),
+        # events of a user
+        Index("ix_user_event_user_id_event_id", "user_id", "event_id"),
+    )
 
 class Notification(Base):
     __tablename__ = "notifications"
@@ -87,3 +122,22 @@ class Notification(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow)
     users = relationship("User", back_populates="notifications")
+
+
+# deleted rows, kept for the incremental sync
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String)
+    entity_id = Column(Integer)
+    company_id = Column(Integer, nullable=True)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+# version of the data of each company (0 for the whole database), bumped by every change
+class TenantVersion(Base):
+    __tablename__ = "tenant_versions"
+
+    company_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, default=0)
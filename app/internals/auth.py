@@ -11,16 +11,20 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 # Local Imports
 from entities import User as UserEntity
-from crypt import hash_password, decrypt
+from crypt import hash_password, decrypt, blind_index
+from cache import LRUCache
 
 router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# authenticated principals, keyed by (user id, token)
+principal_cache = LRUCache(max_entries=1024, ttl=60)
+
 JWT_KEY = "cW1nT8kIC7L8ZnijSHckA2c8f4TgN0DQcI6utcVgZJUdyFv0v0Bek8hxSKESeQV0zjMaK56x2CrzrMuyQBVB7lZ3NiSdvuxJTu18YD55nIBQLRIklzaiYT24iDGJihxvqnsZsmuwJaRFpygLBoRTaa5kVp9eQdmSBWwQ3SooRWTwsWaZDm9CVm3yb3P3X4IAlaAJwT4k"
 
 
-async def decode_token(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)) -> User:
+def decode_token(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -28,43 +32,52 @@ async def decode_token(token: Annotated[str, Depends(oauth2_scheme)], db: Sessio
     )
     try:
         decoded = jwt.decode(token, JWT_KEY, algorithms=["HS256"])
-        user = db.query(UserEntity).filter_by(
+    except JWTError:
+        raise credentials_exception
+
+    cache_key = (decoded["id"], token)
+    user = principal_cache.get(cache_key)
+    if user == None:
+        db_user = db.query(UserEntity).filter_by(
             id=decoded["id"]).first()
-        if user == None:
+        if db_user == None:
             raise credentials_exception
-        user = user.__dict__
-        user["first_name"] = decrypt(user["first_name"])
-        user["last_name"] = decrypt(user["last_name"])
-        user["email"] = decrypt(user["email"])
-        if user == None:
-            raise credentials_exception
-    except JWTError:
-        return credentials_exception
-    return user
+        user = dict(
+            id=db_user.id,
+            first_name=decrypt(db_user.first_name),
+            last_name=decrypt(db_user.last_name),
+            email=decrypt(db_user.email),
+            role=db_user.role,
+            company_id=db_user.company_id,
+            created_at=db_user.created_at,
+            updated_at=db_user.updated_at
+        )
+        principal_cache.set(cache_key, user)
+    # routes may modify the principal, never hand out the cached dict
+    return dict(user)
+
+
+def invalidate_principal(userId: int):
+    """
+    Drop the cached principals of a user, to call whenever
+    the user, its role or its company changes
+    """
+    principal_cache.discard_where(lambda key: key[0] == userId)
 
 
 @router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
     Authentifie l'utilisateur via son email et son mot de passe
     """
     hashedPassword = hash_password(form_data.password)
-    users = [user.__dict__ for user in db.query(UserEntity).all()]
-    userFound = False
-    
-    for user in users:
-        if decrypt(user["email"]) == form_data.username:
-            userFound = user
-            break
+    userFound = db.query(UserEntity).filter_by(
+        email_index=blind_index(form_data.username)).first()
 
-    if userFound != False:
-        userFound = UserEntity(
-            id=userFound["id"],
-            password_hash=userFound["password_hash"]
-        ).__dict__
-        if hashedPassword == userFound["password_hash"]:
+    if userFound != None:
+        if hashedPassword == userFound.password_hash:
             data = dict()
-            data["id"] = userFound["id"]
+            data["id"] = userFound.id
             return {
                 "access_token": jwt.encode(data, JWT_KEY, algorithm="HS256"),
                 "token_type": "bearer"
@@ -0,0 +1,140 @@
+# System Imports
+import datetime
+# Libs Imports
+from sqlalchemy import DateTime, Integer, String, insert, literal, select
+from sqlalchemy.orm import Session
+# Local Imports
+from entities import Company as CompanyEntity, Planning as PlanningEntity, Event as EventEntity, UserEvent as UserEventEntity, User as UserEntity, Notification as NotificationEntity, Tombstone as TombstoneEntity
+from db.database import SessionLocal
+from internals.directory import invalidate_directory
+from internals.versioning import bump_version, attended_company_ids
+
+# rows of events deleted per transaction in chunked mode
+CASCADE_CHUNK_SIZE = 1000
+DELETED_COUNTS_HEADER = "X-Deleted-Counts"
+
+
+def _delete(db: Session, entity, where, counts: dict, tombstone: str = None, company_id: int = None):
+    """
+    Bulk delete the rows of entity matching where, after keeping their
+    tombstones (with a single INSERT ... SELECT) when tombstone is given
+    """
+    if tombstone:
+        db.execute(insert(TombstoneEntity).from_select(
+            ["entity", "entity_id", "company_id", "deleted_at"],
+            select(
+                literal(tombstone, String),
+                entity.id,
+                literal(company_id, Integer),
+                literal(datetime.datetime.utcnow(), DateTime),
+            ).where(where)
+        ))
+    deleted = db.query(entity).filter(where).delete(synchronize_session=False)
+    counts[entity.__tablename__] = counts.get(entity.__tablename__, 0) + deleted
+
+
+def _delete_events(db: Session, events_where, counts: dict, company_id: int = None, chunk_size: int = None):
+    """
+    Delete the events matching events_where and their attendees.\n
+    With chunk_size, the events are deleted chunk_size at a time,
+    each chunk in its own transaction.
+    """
+    if chunk_size == None:
+        event_ids = select(EventEntity.id).where(events_where)
+        _delete(db, UserEventEntity, UserEventEntity.event_id.in_(event_ids),
+                counts, "user_event", company_id)
+        _delete(db, EventEntity, events_where, counts, "events", company_id)
+        return
+
+    while True:
+        event_ids = db.execute(
+            select(EventEntity.id).where(events_where)
+            .order_by(EventEntity.id).limit(chunk_size)).scalars().all()
+        if not event_ids:
+            break
+        _delete(db, UserEventEntity, UserEventEntity.event_id.in_(event_ids),
+                counts, "user_event", company_id)
+        _delete(db, EventEntity, EventEntity.id.in_(event_ids),
+                counts, "events", company_id)
+        bump_version(db, company_id)
+        db.commit()
+
+
+def delete_event(db: Session, event_id: int, company_id: int = None) -> dict:
+    """
+    Delete an event and its attendees, returns the number of deleted rows per table
+    """
+    counts = dict()
+    _delete_events(db, EventEntity.id == event_id, counts, company_id)
+    bump_version(db, company_id)
+    return counts
+
+
+def delete_planning(db: Session, planning_id: int, company_id: int = None, chunk_size: int = None) -> dict:
+    """
+    Delete a planning, its events and their attendees,
+    returns the number of deleted rows per table
+    """
+    counts = dict()
+    _delete_events(db, EventEntity.planning_id == planning_id,
+                   counts, company_id, chunk_size)
+    _delete(db, PlanningEntity, PlanningEntity.id == planning_id,
+            counts, "plannings", company_id)
+    bump_version(db, company_id)
+    return counts
+
+
+def delete_company(db: Session, company_id: int, chunk_size: int = None) -> dict:
+    """
+    Delete a company, its plannings, their events and their attendees,
+    returns the number of deleted rows per table.\n
+    The users of the company are kept.
+    """
+    counts = dict()
+    planning_ids = select(PlanningEntity.id).where(
+        PlanningEntity.company_id == company_id)
+    _delete_events(db, EventEntity.planning_id.in_(planning_ids),
+                   counts, company_id, chunk_size)
+    _delete(db, PlanningEntity, PlanningEntity.company_id == company_id,
+            counts, "plannings", company_id)
+    _delete(db, CompanyEntity, CompanyEntity.id == company_id,
+            counts, "companies", company_id)
+    bump_version(db, company_id)
+    return counts
+
+
+def delete_user(db: Session, user_id: int, company_id: int = None) -> dict:
+    """
+    Delete a user, its participations and its notifications,
+    returns the number of deleted rows per table.\n
+    The events owned by the user are kept.
+    """
+    counts = dict()
+    company_ids = [company_id, *attended_company_ids(db, user_id)]
+    _delete(db, UserEventEntity, UserEventEntity.user_id == user_id,
+            counts, "user_event", company_id)
+    _delete(db, NotificationEntity, NotificationEntity.user_id == user_id, counts)
+    _delete(db, UserEntity, UserEntity.id == user_id,
+            counts, "users", company_id)
+    bump_version(db, *company_ids)
+    return counts
+
+
+def delete_company_in_background(company_id: int):
+    """
+    Chunked deletion of a company, in its own session, for very large companies
+    """
+    db = SessionLocal()
+    try:
+        delete_company(db, company_id, chunk_size=CASCADE_CHUNK_SIZE)
+        db.commit()
+    finally:
+        db.close()
+    invalidate_directory(company_id)
+
+
+def format_counts(counts: dict) -> str:
+    """
+    Value of the X-Deleted-Counts header, table=count separated by commas
+    """
+    return ", ".join(f"{table}={count}" for table, count in counts.items())
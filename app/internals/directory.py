@@ -0,0 +1,70 @@
+# System Imports
+import datetime
+# Libs Imports
+from sqlalchemy.orm import Session
+# Local Imports
+from entities import User as UserEntity
+from crypt import decrypt_many
+from cache import LRUCache
+
+# decrypted users of each company, keyed by company id (None for the users without company)
+directory_cache = LRUCache(max_entries=256, ttl=300)
+
+
+def _decrypt_users(db_users: list) -> dict:
+    first_names = decrypt_many([user.first_name for user in db_users])
+    last_names = decrypt_many([user.last_name for user in db_users])
+    emails = decrypt_many([user.email for user in db_users])
+    return {
+        user.id: dict(
+            id=user.id,
+            first_name=first_names[i],
+            last_name=last_names[i],
+            email=emails[i],
+            role=user.role,
+            company_id=user.company_id,
+            created_at=datetime.datetime.timestamp(user.created_at),
+            updated_at=datetime.datetime.timestamp(user.updated_at)
+        )
+        for i, user in enumerate(db_users)
+    }
+
+
+def get_directory(db: Session, company_id: int) -> dict:
+    """
+    Decrypted users of a company, indexed by their id
+    """
+    directory = directory_cache.get(company_id)
+    if directory is None:
+        db_users = db.query(UserEntity).filter_by(company_id=company_id).all()
+        directory = _decrypt_users(db_users)
+        directory_cache.set(company_id, directory)
+    return directory
+
+
+def find_users(db: Session, user_ids, company_id: int = None) -> dict:
+    """
+    Decrypted users indexed by their id.\n
+    The users are looked up in the directory of company_id first,
+    the others (or all of them without company_id) are loaded by id.
+    """
+    user_ids = set(user_ids)
+    users = dict()
+    if company_id != None:
+        directory = get_directory(db, company_id)
+        users = {id: directory[id] for id in user_ids if id in directory}
+    missing = user_ids.difference(users)
+    if missing:
+        db_users = db.query(UserEntity).filter(
+            UserEntity.id.in_(missing)).all()
+        users.update(_decrypt_users(db_users))
+    return users
+
+
+def invalidate_directory(*company_ids: int):
+    """
+    Drop the cached directories of the given companies, to call whenever
+    a user of these companies is created, changed, deleted or moved
+    """
+    for company_id in company_ids:
+        directory_cache.discard(company_id)
@@ -0,0 +1,62 @@
+# Libs Imports
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+
+def parse_fields(fields: str, model: type[BaseModel]) -> dict:
+    """
+    Sparse fieldset of a ?fields= parameter: a comma separated list of fields
+    of model, and of its collections as collection.field (the whole items
+    with the collection name alone).\n
+    Returns None when fields isn't given (every field is wanted), otherwise
+    {field: None, collection: set of fields or None for all of them}.
+    The ids are always included.
+    """
+    if fields == None:
+        return None
+
+    fieldset = {"id": None}
+    for name in fields.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        field, _, sub_field = name.partition(".")
+        model_field = model.__fields__.get(field)
+        if model_field == None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unknown field {field}")
+        if not sub_field:
+            fieldset[field] = None
+            continue
+        item_model = model_field.type_
+        if not (isinstance(item_model, type) and issubclass(item_model, BaseModel)) or sub_field not in item_model.__fields__:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unknown field {name}")
+        if field in fieldset and fieldset[field] == None:
+            continue
+        fieldset.setdefault(field, {"id"}).add(sub_field)
+    return fieldset
+
+
+def wants(fieldset: dict, field: str) -> bool:
+    return fieldset == None or field in fieldset
+
+
+def sub_fieldset(fieldset: dict, field: str) -> dict:
+    """
+    Fieldset of the items of a collection, None when all their fields are wanted
+    """
+    if fieldset == None or fieldset.get(field) == None:
+        return None
+    return {sub_field: None for sub_field in fieldset[field]}
+
+
+def fieldset_columns(entity, fieldset: dict, *required: str) -> list:
+    """
+    Attributes of the columns of entity in the fieldset and of the required ones,
+    for load_only(), None when every field is wanted
+    """
+    if fieldset == None:
+        return None
+    names = set(required).union(fieldset)
+    return [getattr(entity, column.key) for column in entity.__table__.columns if column.key in names]
@@ -0,0 +1,40 @@
+def merge_intervals(intervals: list) -> list:
+    """
+    Merge overlapping or touching (start, end) intervals,
+    sort and sweep in O(n log n)
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def clip_intervals(intervals: list, window_start, window_end) -> list:
+    """
+    Restrict the intervals to [window_start, window_end[, dropping the empty ones
+    """
+    clipped = []
+    for start, end in intervals:
+        start, end = max(start, window_start), min(end, window_end)
+        if start < end:
+            clipped.append((start, end))
+    return clipped
+
+
+def free_gaps(busy: list, window_start, window_end) -> list:
+    """
+    Gaps of [window_start, window_end[ not covered by the merged busy intervals
+    """
+    gaps = []
+    cursor = window_start
+    for start, end in busy:
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < window_end:
+        gaps.append((cursor, window_end))
+    return gaps
@@ -0,0 +1,53 @@
+# System Imports
+import base64
+import json
+# Libs Imports
+from fastapi import HTTPException, Response, status
+from sqlalchemy.orm import Query
+
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Opaque cursor pointing after the row last_id
+    """
+    payload = json.dumps({"id": last_id}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(payload)["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid cursor")
+
+
+def keyset(query: Query, id_column, cursor: str) -> Query:
+    """
+    Rows of query after the cursor, ordered by id_column
+    """
+    if cursor:
+        query = query.filter(id_column > decode_cursor(cursor))
+    return query.order_by(id_column)
+
+
+def paginate(query: Query, id_column, cursor: str, limit: int, response: Response, row_id=lambda row: row.id) -> list:
+    """
+    Keyset pagination of query on id_column.\n
+    Without limit, every row after the cursor is returned.
+    Otherwise, when rows remain after the page, the cursor
+    of the next page is sent in the X-Next-Cursor header.
+    """
+    query = keyset(query, id_column, cursor)
+    if limit == None:
+        return query.all()
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(row_id(rows[-1]))
+    return rows
@@ -0,0 +1,89 @@
+# System Imports
+from contextvars import ContextVar
+# Libs Imports
+from fastapi import Request, Response, status
+from fastapi.responses import ORJSONResponse
+import msgpack
+
+MSGPACK_MEDIA_TYPES = ["application/msgpack", "application/x-msgpack"]
+JSON_MEDIA_TYPE = "application/json"
+
+# MessagePack media type accepted by the current request, None for JSON
+_msgpack_media_type: ContextVar[str] = ContextVar(
+    "msgpack_media_type", default=None)
+
+
+def parse_accept(accept: str) -> dict:
+    """
+    Quality (q, 1 by default) of each media range of an Accept header
+    """
+    qualities = dict()
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type.lower()] = max(quality, qualities.get(media_type.lower(), 0.0))
+    return qualities
+
+
+def msgpack_media_type(accept: str) -> str:
+    """
+    MessagePack media type to answer with, None for JSON.\n
+    MessagePack must be named (not only matched by */*), with a q above 0 and at
+    least the q of JSON (given by its most specific range, 0 when not accepted).
+    """
+    qualities = parse_accept(accept)
+    quality, media_type = max((qualities.get(media_type, 0.0), media_type)
+                              for media_type in MSGPACK_MEDIA_TYPES)
+    if quality <= 0:
+        return None
+    json_quality = next((qualities[media_range] for media_range in (
+        JSON_MEDIA_TYPE, "application/*", "*/*") if media_range in qualities), 0.0)
+    return media_type if quality >= json_quality else None
+
+
+async def negotiate_content(request: Request):
+    """
+    Remember whether the request accepts MessagePack for the responses built while
+    handling it (async so that it runs in the request's context, which the route's
+    thread inherits)
+    """
+    _msgpack_media_type.set(msgpack_media_type(request.headers.get("accept", "")))
+
+
+class NegotiatedResponse(ORJSONResponse):
+    """
+    JSON response, or MessagePack when the request prefers application/msgpack
+    (or application/x-msgpack), with the same content: the timestamps stay ints
+    """
+
+    def render(self, content) -> bytes:
+        media_type = _msgpack_media_type.get()
+        if media_type == None:
+            return super().render(content)
+        self.media_type = media_type
+        return msgpack.packb(content)
+
+    def init_headers(self, headers=None):
+        super().init_headers(headers)
+        self.raw_headers.append((b"vary", b"Accept"))
+
+
+def trusted_response(content, response: Response) -> NegotiatedResponse:
+    """
+    Response of content built by the serializers, which is already shaped
+    like the response model: it is encoded without being validated again.\n
+    The status and headers set on the route's response (ETag, X-Next-Cursor) are kept.
+    """
+    negotiated_response = NegotiatedResponse(
+        content, status_code=response.status_code or status.HTTP_200_OK)
+    negotiated_response.headers.raw.extend(response.headers.raw)
+    return negotiated_response
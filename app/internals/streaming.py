@@ -0,0 +1,37 @@
+# Libs Imports
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+import orjson
+from sqlalchemy.orm import Query
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = 500
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def stream_ndjson(query: Query, serialize, chunk_size: int = STREAM_CHUNK_SIZE) -> StreamingResponse:
+    """
+    Stream the rows of query as NDJSON, one record per line.\n
+    Rows are fetched chunk_size at a time from a server side cursor and
+    serialize(rows) turns each chunk into dicts (see serializers.py),
+    so the memory used doesn't depend on the number of rows.
+    """
+    def lines():
+        chunk = []
+        for row in query.yield_per(chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield from _serialize_chunk(chunk, serialize)
+                chunk = []
+        if chunk:
+            yield from _serialize_chunk(chunk, serialize)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def _serialize_chunk(chunk: list, serialize):
+    for item in serialize(chunk):
+        yield orjson.dumps(item) + b"\n"
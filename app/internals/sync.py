@@ -0,0 +1,35 @@
+# System Imports
+import base64
+import datetime
+import json
+# Libs Imports
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+# Local Imports
+from entities import Tombstone as TombstoneEntity
+
+
+def record_deletions(db: Session, entity: str, ids: list, company_id: int = None):
+    """
+    Keep a tombstone of the deleted rows, committed with the deletion itself
+    """
+    now = datetime.datetime.utcnow()
+    db.add_all([
+        TombstoneEntity(entity=entity, entity_id=id,
+                        company_id=company_id, deleted_at=now)
+        for id in ids
+    ])
+
+
+def encode_sync_token(since: datetime.datetime) -> str:
+    payload = json.dumps({"since": since.isoformat()}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> datetime.datetime:
+    try:
+        payload = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        return datetime.datetime.fromisoformat(json.loads(payload)["since"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid sync token")
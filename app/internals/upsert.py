@@ -0,0 +1,23 @@
+# Libs Imports
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+
+def insert_or_ignore(db: Session, entity, rows: list, index_elements: list) -> int:
+    """
+    INSERT ... ON CONFLICT DO NOTHING of the rows, the conflicts being
+    checked on the unique index of index_elements.\n
+    Returns the number of inserted rows (when the driver reports it).
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(entity.__table__).on_conflict_do_nothing(
+            index_elements=index_elements)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(entity.__table__).on_conflict_do_nothing(
+            index_elements=index_elements)
+    else:
+        # no portable upsert, the unique index still rejects the duplicates
+        statement = insert(entity.__table__)
+    return db.execute(statement, rows).rowcount
@@ -0,0 +1,111 @@
+# System Imports
+import hashlib
+import os
+# Libs Imports
+from fastapi import Request, Response, status
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+# Local Imports
+from entities import TenantVersion as TenantVersionEntity, UserEvent as UserEventEntity, Event as EventEntity, Planning as PlanningEntity
+from internals.upsert import insert_or_ignore
+
+# version of the data outside of any company, and tenant of the MAINTAINER
+GLOBAL_TENANT = 0
+# every change also bumps one of these counters (rows -1 to -VERSION_SHARDS,
+# picked by company), the version of the whole database is their sum: it is read
+# from a fixed number of rows, and writers of different companies only wait for
+# each other when their companies share a counter
+VERSION_SHARDS = int(os.environ.get("VERSION_SHARDS", 16))
+
+
+def _bump(db: Session, tenant: int):
+    version = db.query(TenantVersionEntity).filter_by(company_id=tenant)
+    updated = version.update(
+        {TenantVersionEntity.version: TenantVersionEntity.version + 1},
+        synchronize_session=False)
+    if not updated:
+        # first change of the tenant, a concurrent first change may insert it too
+        insert_or_ignore(db, TenantVersionEntity, [dict(
+            company_id=tenant, version=0)], ["company_id"])
+        version.update(
+            {TenantVersionEntity.version: TenantVersionEntity.version + 1},
+            synchronize_session=False)
+
+
+def bump_version(db: Session, *company_ids: int):
+    """
+    Mark the data of the given companies (of no company without them) as changed,
+    to call in the transaction of every change
+    """
+    tenants = sorted({company_id for company_id in company_ids if company_id != None}) or [GLOBAL_TENANT]
+    # rows always locked in the same order (counter first), so writers don't deadlock
+    _bump(db, -1 - tenants[0] % VERSION_SHARDS)
+    for tenant in tenants:
+        _bump(db, tenant)
+
+
+def attended_company_ids(db: Session, user_id: int) -> list:
+    """
+    Companies of the events a user attends: their events embed the user,
+    so they change with the user (who may be of another company)
+    """
+    return [company_id for company_id, in (
+        db.query(PlanningEntity.company_id)
+        .join(EventEntity, EventEntity.planning_id == PlanningEntity.id)
+        .join(UserEventEntity, UserEventEntity.event_id == EventEntity.id)
+        .filter(UserEventEntity.user_id == user_id)
+        .distinct()
+    )]
+
+
+def get_version(db: Session, company_id: int) -> int:
+    """
+    Version of the data of a company, of the whole database for GLOBAL_TENANT
+    """
+    if company_id == GLOBAL_TENANT:
+        version = db.query(func.sum(TenantVersionEntity.version)).filter(
+            TenantVersionEntity.company_id < 0,
+            TenantVersionEntity.company_id >= -VERSION_SHARDS).scalar()
+    else:
+        version = db.query(TenantVersionEntity.version).filter_by(
+            company_id=company_id).scalar()
+    return version or 0
+
+
+def collection_etag(db: Session, request: Request, authUser: dict) -> str:
+    """
+    Weak ETag of a collection, from the version of the data the user can see
+    and everything else the response depends on (role, company, query, format)
+    """
+    tenant = GLOBAL_TENANT
+    if authUser["role"] != "MAINTAINER" and authUser["company_id"] != None:
+        tenant = authUser["company_id"]
+    # the global version only grows for a given number of counters
+    label = f"all{VERSION_SHARDS}" if tenant == GLOBAL_TENANT else tenant
+    variant = "|".join([
+        request.url.path,
+        authUser["role"],
+        str(authUser["company_id"]),
+        str(request.url.query),
+        request.headers.get("accept", ""),
+    ])
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:16]
+    return f'W/"{label}-{get_version(db, tenant)}-{digest}"'
+
+
+def not_modified(db: Session, request: Request, response: Response, authUser: dict) -> Response:
+    """
+    304 response when the client already has the current version of the collection,
+    otherwise sets the ETag header of the response and returns None
+    """
+    etag = collection_etag(db, request, authUser)
+    # weak comparison, the W/ prefix is ignored
+    if_none_match = [
+        tag.strip().removeprefix("W/")
+        for tag in request.headers.get("if-none-match", "").split(",")
+    ]
+    if etag.removeprefix("W/") in if_none_match or "*" in if_none_match:
+        # the ETag depends on Accept, as the content of the 200 does
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Vary": "Accept"})
+    response.headers["ETag"] = etag
+    return None
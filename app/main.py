@@ -1,15 +1,31 @@
 # System imports
+import os
 # Libs imports
-from fastapi import FastAPI
+import anyio
+from fastapi import FastAPI, Depends
 # Local imports
-from routers import user, company, planning, event
+from routers import user, company, planning, event, availability, sync
 from internals import auth
+from internals.responses import NegotiatedResponse, negotiate_content
 from db.database import engine, Base
+from db.migrations import upgrade
 
 Base.metadata.create_all(bind=engine)
+upgrade(engine)
 
 
-app = FastAPI()
+# JSON responses, MessagePack ones for the clients sending Accept: application/msgpack
+app = FastAPI(default_response_class=NegotiatedResponse,
+              dependencies=[Depends(negotiate_content)])
+
+# threads running the route handlers, which block on the database and on decryption,
+# keep it at most DB_POOL_SIZE + DB_MAX_OVERFLOW so that no thread waits for a connection
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", 30))
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
 
 
 custom_responses = {
@@ -26,5 +42,8 @@ app.include_router(user.router, tags=["users"], responses=custom_responses)
 app.include_router(company.router, tags=["companies"], responses=custom_responses)
 app.include_router(planning.router, tags=["plannings"], responses=custom_responses)
 app.include_router(event.router, tags=["events"], responses=custom_responses)
+app.include_router(availability.router, tags=[
+                   "availability"], responses=custom_responses)
+app.include_router(sync.router, tags=["sync"], responses=custom_responses)
 app.include_router(auth.router, tags=[
                    "authentication"], responses=custom_responses)
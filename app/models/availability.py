@@ -0,0 +1,24 @@
+# Libs imports
+from pydantic import BaseModel
+
+
+class TimeRange(BaseModel):
+    start: int
+    end: int
+
+
+class UserBusy(BaseModel):
+    user_id: int
+    busy: list[TimeRange] = []
+
+
+class FreeBusy(BaseModel):
+    start: int
+    end: int
+    users: list[UserBusy] = []
+    free: list[TimeRange] = []
+
+
+class SlotProposal(BaseModel):
+    duration: int
+    slots: list[TimeRange] = []
@@ -1,5 +1,5 @@
 # Libs imports
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class UserEventInfo(BaseModel):
@@ -37,3 +37,17 @@ class EventChangeableFields(BaseModel):
 
 class DefaultResponse(BaseModel):
     success: bool
+
+
+class Attendees(BaseModel):
+    user_ids: list[int] = Field(min_items=1, max_items=1000)
+
+
+class AttendeeResult(BaseModel):
+    user_id: int
+    status: str
+
+
+class AttendeesReport(BaseModel):
+    changed: int
+    results: list[AttendeeResult]
@@ -0,0 +1,32 @@
+# Libs imports
+from pydantic import BaseModel
+# Local imports
+from models.user import User
+from models.company import Company
+from models.planning import Planning
+from models.event import Event
+
+
+class UserEventChange(BaseModel):
+    id: int
+    user_id: int
+    event_id: int
+    accepted: bool = None
+    added_at: int = None
+    updated_at: int = None
+
+
+class Deletion(BaseModel):
+    entity: str
+    id: int
+    deleted_at: int
+
+
+class SyncChanges(BaseModel):
+    token: str
+    users: list[User] = []
+    companies: list[Company] = []
+    plannings: list[Planning] = []
+    events: list[Event] = []
+    user_event: list[UserEventChange] = []
+    deleted: list[Deletion] = []
@@ -31,3 +31,25 @@ class UserChangeableFields(BaseModel):
     email: str = None
     password_hash: str = None
     role: UserRole = None
+
+
+class UserImport(BaseModel):
+    first_name: str
+    last_name: str
+    email: str
+    password_hash: str
+    role: UserRole = UserRole.user
+
+
+class UserImportResult(BaseModel):
+    row: int
+    email: str = None
+    id: int = None
+    status: str
+    detail: str = None
+
+
+class UserImportReport(BaseModel):
+    created: int
+    failed: int
+    results: list[UserImportResult]
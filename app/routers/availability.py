@@ -0,0 +1,228 @@
+# System Imports
+from typing import Annotated
+import datetime
+# Libs Imports
+from fastapi import APIRouter, status, HTTPException, Query
+import numpy as np
+from sqlalchemy.orm import Session
+from fastapi import Depends
+# Local Imports
+from entities import Event as EventEntity, UserEvent as UserEventEntity, User as UserEntity, Planning as PlanningEntity
+from models.availability import FreeBusy, SlotProposal
+from models.user import User
+from dependencies import get_db
+from internals.auth import decode_token
+from internals.intervals import merge_intervals, clip_intervals, free_gaps
+from crypt import decrypt_many
+
+router = APIRouter()
+
+# time step of the slot search, also the minimum duration of an event
+SLOT_QUANTUM = datetime.timedelta(minutes=15)
+MAX_SLOT_SEARCH_WINDOW = datetime.timedelta(days=92)
+MAX_SLOT_COUNT = 50
+
+
+def parse_window(from_date: int, to_date: int) -> tuple:
+    """
+    [from, to[ window of timestamps in seconds, as datetimes
+    """
+    try:
+        start = datetime.datetime.fromtimestamp(from_date)
+        end = datetime.datetime.fromtimestamp(to_date)
+    except:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid date format, please use timestamp in seconds")
+    if (start >= end):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="from must be before to")
+    return start, end
+
+
+def parse_user_ids(users: str) -> list:
+    """
+    Distinct ids of a comma separated list of user ids
+    """
+    try:
+        user_ids = [int(id) for id in users.split(",") if id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="users must be a comma separated list of ids")
+    if not user_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="users must be a comma separated list of ids")
+    return list(dict.fromkeys(user_ids))
+
+
+def check_users_scope(db: Session, user_ids: list, authUser: dict):
+    """
+    Every user must exist and, unless you are MAINTAINER, be in your company
+    """
+    db_users = db.query(UserEntity.id, UserEntity.company_id).filter(
+        UserEntity.id.in_(user_ids)).all()
+    if len(db_users) != len(user_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="User not found")
+    for db_user in db_users:
+        if db_user.company_id != authUser["company_id"] and authUser["role"] != "MAINTAINER":
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail="Unauthorized")
+
+
+def get_busy_intervals(db: Session, user_ids: list, start: datetime.datetime, end: datetime.datetime) -> dict:
+    """
+    Merged intervals of the accepted events of each user overlapping [start, end[
+    """
+    rows = (
+        db.query(UserEventEntity.user_id, EventEntity.start_date, EventEntity.end_date)
+        .join(EventEntity, EventEntity.id == UserEventEntity.event_id)
+        .filter(
+            UserEventEntity.user_id.in_(user_ids),
+            UserEventEntity.accepted == True,
+            EventEntity.start_date < end,
+            EventEntity.end_date > start,
+        )
+        .all()
+    )
+    intervals = {user_id: [] for user_id in user_ids}
+    for user_id, start_date, end_date in rows:
+        intervals[user_id].append((start_date, end_date))
+    return {
+        user_id: merge_intervals(clip_intervals(user_intervals, start, end))
+        for user_id, user_intervals in intervals.items()
+    }
+
+
+def to_time_ranges(intervals: list) -> list:
+    return [
+        dict(start=int(datetime.datetime.timestamp(start)),
+             end=int(datetime.datetime.timestamp(end)))
+        for start, end in intervals
+    ]
+
+
+@router.get("/freebusy")
+def get_freebusy(users: str, from_date: int = Query(alias="from"), to_date: int = Query(alias="to"), db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> FreeBusy:
+    """
+    Disponibilités d'un ensemble d'utilisateurs entre from et to (timestamps en secondes).\n
+    users: liste d'ids séparés par des virgules.\n
+    Renvoie les créneaux occupés (événements acceptés) de chaque utilisateur
+    et les créneaux où tous sont libres.\n
+    Vous ne pouvez consulter que les utilisateurs de votre entreprise, sauf si vous êtes MAINTAINER.
+    """
+    start, end = parse_window(from_date, to_date)
+    user_ids = parse_user_ids(users)
+    check_users_scope(db, user_ids, authUser)
+
+    busy = get_busy_intervals(db, user_ids, start, end)
+    all_busy = merge_intervals(
+        [interval for intervals in busy.values() for interval in intervals])
+
+    return dict(
+        start=from_date,
+        end=to_date,
+        users=[
+            dict(user_id=user_id, busy=to_time_ranges(busy[user_id]))
+            for user_id in user_ids
+        ],
+        free=to_time_ranges(free_gaps(all_busy, start, end))
+    )
+
+
+def get_place_intervals(db: Session, place: str, start: datetime.datetime, end: datetime.datetime, authUser: dict) -> list:
+    """
+    Merged intervals of the events held at place overlapping [start, end[.\n
+    Places are encrypted, so the events of the window are decrypted and
+    compared, only within your company unless you are MAINTAINER.
+    """
+    query = (
+        db.query(EventEntity.place, EventEntity.start_date, EventEntity.end_date)
+        .filter(EventEntity.start_date < end, EventEntity.end_date > start)
+    )
+    if authUser["role"] != "MAINTAINER":
+        query = query.join(PlanningEntity).filter(
+            PlanningEntity.company_id == authUser["company_id"])
+    rows = query.all()
+    places = decrypt_many([row.place for row in rows])
+    place = place.strip().lower()
+    return merge_intervals(clip_intervals([
+        (row.start_date, row.end_date)
+        for i, row in enumerate(rows) if places[i].strip().lower() == place
+    ], start, end))
+
+
+def busy_bitmap(intervals: list, start: datetime.datetime, quanta: int) -> np.ndarray:
+    """
+    Boolean array of the quanta after start overlapped by the intervals
+    """
+    bitmap = np.zeros(quanta, dtype=bool)
+    for interval_start, interval_end in intervals:
+        first = int((interval_start - start) // SLOT_QUANTUM)
+        last = -int(-(interval_end - start) // SLOT_QUANTUM)
+        bitmap[max(first, 0):min(last, quanta)] = True
+    return bitmap
+
+
+def find_free_slots(bitmaps: list, slot_quanta: int, count: int) -> list:
+    """
+    Start index of the first count non overlapping runs of slot_quanta
+    quanta that are free in every bitmap
+    """
+    free = np.logical_and.reduce([~bitmap for bitmap in bitmaps])
+    # free quanta in each window of slot_quanta quanta
+    free_count = np.concatenate(([0], np.cumsum(free, dtype=np.int64)))
+    window_free = (free_count[slot_quanta:] -
+                   free_count[:-slot_quanta]) == slot_quanta
+    slots = []
+    next_start = 0
+    for index in np.flatnonzero(window_free):
+        if index < next_start:
+            continue
+        slots.append(int(index))
+        next_start = index + slot_quanta
+        if len(slots) == count:
+            break
+    return slots
+
+
+@router.get("/event-find-slots")
+def find_event_slots(users: str, duration: int = Query(ge=15), from_date: int = Query(alias="from"), to_date: int = Query(alias="to"), place: str = None, count: int = Query(default=5, ge=1, le=MAX_SLOT_COUNT), db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> SlotProposal:
+    """
+    Propose les premiers créneaux (count) de duration minutes entre from et to
+    (timestamps en secondes) où tous les utilisateurs (ids séparés par des virgules)
+    et le lieu (place, optionnel) sont libres.\n
+    Les créneaux commencent sur des quarts d'heure, une activité dure au moins 15 minutes.
+    """
+    start, end = parse_window(from_date, to_date)
+    if (end - start > MAX_SLOT_SEARCH_WINDOW):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="The search window can't exceed 92 days")
+    user_ids = parse_user_ids(users)
+    check_users_scope(db, user_ids, authUser)
+
+    # slots start on a quantum boundary
+    quantum_seconds = int(SLOT_QUANTUM.total_seconds())
+    first_quantum = -(-from_date // quantum_seconds) * quantum_seconds
+    start = datetime.datetime.fromtimestamp(first_quantum)
+    quanta = max(int((end - start) // SLOT_QUANTUM), 0)
+    slot_quanta = -(-duration * 60 // quantum_seconds)
+    if (quanta < slot_quanta):
+        return dict(duration=duration, slots=[])
+
+    busy = get_busy_intervals(db, user_ids, start, end)
+    bitmaps = [busy_bitmap(busy[user_id], start, quanta)
+               for user_id in user_ids]
+    if place:
+        bitmaps.append(busy_bitmap(get_place_intervals(
+            db, place, start, end, authUser), start, quanta))
+
+    slots = find_free_slots(bitmaps, slot_quanta, count)
+
+    return dict(
+        duration=duration,
+        slots=[
+            dict(start=first_quantum + index * quantum_seconds,
+                 end=first_quantum + index * quantum_seconds + duration * 60)
+            for index in slots
+        ]
+    )
@@ -2,99 +2,97 @@
 from typing import Annotated
 import datetime
 # Libs Imports
-from fastapi import APIRouter, status, HTTPException
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, status, HTTPException, Query, Request, Response, BackgroundTasks
+from sqlalchemy.orm import Session, selectinload, load_only
 from fastapi import Depends
 # Local Imports
 from models.company import Company, CompanyChangeableFields, AddToCompany
 from models.user import User
-from routers.user import get_user_by_id
-from entities import Company as CompanyEntity, User as UserEntity, Planning as PlanningEntity, Event as EventEntity
+from routers.user import decrypt_user
+from entities import Company as CompanyEntity, User as UserEntity, Planning as PlanningEntity
 from dependencies import get_db
-from internals.auth import decode_token
+from internals.auth import decode_token, invalidate_principal
+from internals.cascade import delete_company, delete_company_in_background, format_counts, DELETED_COUNTS_HEADER
+from internals.directory import invalidate_directory
+from internals.fieldsets import parse_fields, sub_fieldset, wants, fieldset_columns
+from internals.pagination import keyset, paginate, MAX_PAGE_SIZE
+from internals.responses import trusted_response
+from internals.streaming import wants_ndjson, stream_ndjson
+from internals.sync import record_deletions
+from internals.versioning import bump_version, not_modified
+from serializers import serialize_companies
 from crypt import encrypt, decrypt
 
 router = APIRouter()
 
 
 @router.get("/companies")
-async def get_companies(db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> list[Company]:
+def get_companies(request: Request, response: Response, include: str = "users,plannings", fields: str = None, cursor: str = None, limit: int = Query(default=None, ge=1, le=MAX_PAGE_SIZE), db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> list[Company]:
     """
     Récupérer toutes les entreprises.\n
     Si l'utilisateur est un MAINTAINER, il peut récupérer toutes les entreprises.\n
-    Sinon vous récupérez seulement votre entreprise dans le tableau.
+    Sinon vous récupérez seulement votre entreprise dans le tableau.\n
+    include liste les collections à renvoyer parmi users et plannings
+    (par défaut les deux, vide pour n'avoir que les entreprises).\n
+    fields liste les champs à renvoyer, ceux des collections sous la forme
+    users.first_name (par exemple id,name,users.first_name), les id sont
+    toujours renvoyés.\n
+    Pagination: limit donne la taille de la page, le curseur de la page
+    suivante est renvoyé dans le header X-Next-Cursor (paramètre cursor).\n
+    Avec le header Accept: application/x-ndjson, les entreprises sont envoyées
+    en flux, une par ligne.
     """
+    notModified = not_modified(db, request, response, authUser)
+    if notModified:
+        return notModified
+
+    includes = [collection.strip() for collection in include.split(",") if collection.strip()]
+    if any(collection not in ["users", "plannings"] for collection in includes):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="include must only contain users and plannings")
+    fieldset = parse_fields(fields, Company)
+    include_users = "users" in includes and wants(fieldset, "users")
+    include_plannings = "plannings" in includes and wants(fieldset, "plannings")
+
+    # one query per collection instead of a users x plannings joined result
+    companies_query = db.query(CompanyEntity)
+    columns = fieldset_columns(CompanyEntity, fieldset, "id")
+    if columns:
+        companies_query = companies_query.options(load_only(*columns))
+    if include_users:
+        users_loader = selectinload(CompanyEntity.users)
+        users_columns = fieldset_columns(
+            UserEntity, sub_fieldset(fieldset, "users"), "id", "company_id")
+        if users_columns:
+            users_loader = users_loader.load_only(*users_columns)
+        companies_query = companies_query.options(users_loader)
+    if include_plannings:
+        plannings_loader = selectinload(CompanyEntity.plannings)
+        plannings_columns = fieldset_columns(
+            PlanningEntity, sub_fieldset(fieldset, "plannings"), "id", "company_id")
+        if plannings_columns:
+            plannings_loader = plannings_loader.load_only(*plannings_columns)
+        companies_query = companies_query.options(plannings_loader)
     if (authUser["role"] != "MAINTAINER"):
         showAll = False
-        db_company = (
-            db.query(CompanyEntity)
-            .outerjoin(UserEntity)
-            .options(joinedload(CompanyEntity.users))
-            .options(joinedload(CompanyEntity.plannings))
-            .filter_by(id=authUser["company_id"])
-            .all()
-        )
+        companies_query = companies_query.filter_by(id=authUser["company_id"])
     else:
         showAll = True
-        db_company = (
-            db.query(CompanyEntity)
-            .outerjoin(UserEntity)
-            .options(joinedload(CompanyEntity.users))
-            .options(joinedload(CompanyEntity.plannings))
-            .all()
-        )
-
-    db_company_dict = []
-    for company in db_company:
-        company_dict = company.__dict__
-        company_dict["name"] = decrypt(company_dict["name"])
-        company_dict["website"] = decrypt(
-            company_dict["website"]) if company_dict["website"] else None
-        company_dict["city"] = decrypt(
-            company_dict["city"]) if company_dict["city"] else None
-        company_dict["country"] = decrypt(
-            company_dict["country"]) if company_dict["country"] else None
-        company_dict["created_at"] = datetime.datetime.timestamp(
-            company_dict["created_at"])
-        company_dict["updated_at"] = datetime.datetime.timestamp(
-            company_dict["updated_at"])
-        # add users
-        user_list = company_dict["users"]
-        company_dict["users"] = []
-        for user in user_list:
-            user_dict = user.__dict__
-            user_dict["id"] = user_dict["id"]
-            user_dict["first_name"] = decrypt(user_dict["first_name"])
-            user_dict["last_name"] = decrypt(user_dict["last_name"])
-            user_dict["email"] = decrypt(
-                user_dict["email"]) if showAll else None
-            user_dict["role"] = user_dict["role"]
-            user_dict["company_id"] = user_dict["company_id"]
-            user_dict["created_at"] = datetime.datetime.timestamp(
-                user_dict["created_at"])
-            user_dict["updated_at"] = datetime.datetime.timestamp(
-                user_dict["updated_at"])
-            company_dict["users"].append(user_dict)
-        # add plannings
-        planning_list = company_dict["plannings"]
-        company_dict["plannings"] = []
-        for planning in planning_list:
-            planning_dict = planning.__dict__
-            planning_dict["id"] = planning_dict["id"]
-            planning_dict["name"] = decrypt(planning_dict["name"])
-            planning_dict["company_id"] = planning_dict["company_id"]
-            planning_dict["created_at"] = datetime.datetime.timestamp(
-                planning_dict["created_at"])
-            planning_dict["updated_at"] = datetime.datetime.timestamp(
-                planning_dict["updated_at"])
-            company_dict["plannings"].append(planning_dict)
-        db_company_dict.append(company_dict)
-
-    return db_company_dict
+
+    if wants_ndjson(request):
+        return stream_ndjson(
+            keyset(companies_query, CompanyEntity.id, cursor).limit(limit),
+            lambda db_company: serialize_companies(
+                db_company, showAll, include_users, include_plannings, fieldset))
+
+    db_company = paginate(
+        companies_query, CompanyEntity.id, cursor, limit, response)
+
+    return trusted_response(serialize_companies(db_company, showAll, include_users, include_plannings, fieldset), response)
 
 
 @router.post("/company", status_code=status.HTTP_201_CREATED)
-async def create_company(company: CompanyChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Company:
+def create_company(company: CompanyChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Company:
     """
     Créer une entreprise.\n
     Rôle MAINTAINER requis.\n
@@ -121,24 +119,27 @@ async def create_company(company: CompanyChangeableFields, db: Session = Depends
         country=encrypt(company.country) if company.country else None,
     )
     db.add(db_company)
+    bump_version(db)
     db.commit()
-    db.refresh(db_company)
 
     db_company_decrypted = dict(
         id=db_company.id,
-        name=decrypt(db_company.name),
-        website=decrypt(db_company.website) if db_company.website else None,
-        city=decrypt(db_company.city) if db_company.city else None,
-        country=decrypt(db_company.country) if db_company.country else None,
+        name=company.name,
+        website=company.website if company.website else None,
+        city=company.city if company.city else None,
+        country=company.country if company.country else None,
     )
 
     return db_company_decrypted
 
 
 @router.delete("/company/{companyId}")
-async def delete_company_by_id(companyId: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Company:
+def delete_company_by_id(companyId: int, response: Response, background_tasks: BackgroundTasks, background: bool = False, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Company:
     """
-    Supprimer une entreprise par son id.\n
+    Supprimer une entreprise par son id, avec ses plannings et leurs événements.\n
+    Le nombre de lignes supprimées par table est renvoyé dans le header X-Deleted-Counts.\n
+    Avec background=true, la suppression (par lots) se fait après la réponse (202),
+    pour les très grandes entreprises.\n
     Rôle MAINTAINER requis.
     """
     if (authUser["role"] != "MAINTAINER"):
@@ -151,18 +152,6 @@ async def delete_company_by_id(companyId: int, db: Session = Depends(get_db), au
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Company not found")
 
-    plannings = db.query(PlanningEntity).filter_by(
-    company_id=companyId).all()
-    for planning in plannings:
-        events = db.query(EventEntity).filter_by(
-            planning_id=planning.id).all()
-        for event in events:
-            db.delete(event)
-        db.delete(planning)
-
-    db.delete(db_company)
-    db.commit()
-
     old_company = Company(
         id=db_company.id,
         name=decrypt(db_company.name),
@@ -173,11 +162,21 @@ async def delete_company_by_id(companyId: int, db: Session = Depends(get_db), au
         updated_at=datetime.datetime.timestamp(db_company.updated_at)
     )
 
+    if background:
+        background_tasks.add_task(delete_company_in_background, companyId)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return old_company.__dict__
+
+    counts = delete_company(db, companyId)
+    db.commit()
+    invalidate_directory(companyId)
+    response.headers[DELETED_COUNTS_HEADER] = format_counts(counts)
+
     return old_company.__dict__
 
 
 @router.patch("/company/{companyId}")
-async def update_company_by_id(companyId: int, company: CompanyChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Company:
+def update_company_by_id(companyId: int, company: CompanyChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Company:
     """
     Mettre à jour une entreprise via son id.\n
     Rôle MAINTAINER requis.
@@ -200,16 +199,19 @@ async def update_company_by_id(companyId: int, company: CompanyChangeableFields,
         company.city) if company.city else db_company.city
     db_company.country = encrypt(
         company.country) if company.country else db_company.country
-    db_company.updated_at = datetime.datetime.now()
+    db_company.updated_at = datetime.datetime.utcnow()
+    bump_version(db, companyId)
     db.commit()
-    db.refresh(db_company)
 
     db_company_decrypted = dict(
         id=db_company.id,
-        name=decrypt(db_company.name),
-        website=decrypt(db_company.website) if db_company.website else None,
-        city=decrypt(db_company.city) if db_company.city else None,
-        country=decrypt(db_company.country) if db_company.country else None,
+        name=company.name if company.name else decrypt(db_company.name),
+        website=company.website if company.website else decrypt(
+            db_company.website) if db_company.website else None,
+        city=company.city if company.city else decrypt(
+            db_company.city) if db_company.city else None,
+        country=company.country if company.country else decrypt(
+            db_company.country) if db_company.country else None,
         created_at=datetime.datetime.timestamp(db_company.created_at),
         updated_at=datetime.datetime.timestamp(db_company.updated_at)
     )
@@ -218,7 +220,7 @@ async def update_company_by_id(companyId: int, company: CompanyChangeableFields,
 
 
 @router.post("/company-add-user")
-async def add_user_to_company(info: AddToCompany, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
+def add_user_to_company(info: AddToCompany, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
     """
     Ajouter un utilisateur à une entreprise.\n
     Rôle MAINTAINER requis.
@@ -240,17 +242,21 @@ async def add_user_to_company(info: AddToCompany, db: Session = Depends(get_db),
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="User already in this company")
 
+    old_company_id = db_user.company_id
     db_user.company_id = info.companyId
+    # the user leaves the data of its previous company
+    if old_company_id != None:
+        record_deletions(db, "users", [db_user.id], old_company_id)
+    bump_version(db, old_company_id, info.companyId)
     db.commit()
-    db.refresh(db_user)
+    invalidate_principal(db_user.id)
+    invalidate_directory(old_company_id, info.companyId)
 
-    db_user = await get_user_by_id(db_user.id, db)
-
-    return db_user
+    return decrypt_user(db_user)
 
 
 @router.delete("/company-remove-user/{userId}")
-async def remove_user_from_company(userId: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
+def remove_user_from_company(userId: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
     """
     Supprimer un utilisateur d'une entreprise.\n
     Rôle MAINTAINER requis.
@@ -268,10 +274,12 @@ async def remove_user_from_company(userId: int, db: Session = Depends(get_db), a
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="User does not have a company")
 
+    old_company_id = db_user.company_id
     db_user.company_id = None
+    record_deletions(db, "users", [db_user.id], old_company_id)
+    bump_version(db, old_company_id)
     db.commit()
-    db.refresh(db_user)
-
-    db_user = await get_user_by_id(db_user.id, db)
+    invalidate_principal(db_user.id)
+    invalidate_directory(old_company_id, None)
 
-    return db_user
+    return decrypt_user(db_user)
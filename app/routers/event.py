@@ -2,27 +2,49 @@
 from typing import Annotated
 import datetime
 # Libs Imports
-from fastapi import APIRouter, status, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, status, HTTPException, Query, Request, Response
+from sqlalchemy import and_
+from sqlalchemy.orm import Session, load_only
 from fastapi import Depends
 # Local Imports
 from entities import Event as EventEntity, UserEvent as UserEventEntity, User as UserEntity, Planning as PlanningEntity, Company as CompanyEntity
-from models.event import Event, EventChangeableFields, DefaultResponse
+from models.event import Event, EventChangeableFields, DefaultResponse, Attendees, AttendeesReport
 from models.user import User
-from routers.user import get_user_by_id, get_users
 from dependencies import get_db
 from internals.auth import decode_token
+from internals.cascade import delete_event, format_counts, DELETED_COUNTS_HEADER
+from internals.fieldsets import parse_fields, fieldset_columns
+from internals.pagination import keyset, paginate, MAX_PAGE_SIZE
+from internals.responses import trusted_response
+from internals.streaming import wants_ndjson, stream_ndjson
+from internals.sync import record_deletions
+from internals.upsert import insert_or_ignore
+from internals.versioning import bump_version, not_modified
+from serializers import serialize_events
 from crypt import encrypt, decrypt
 
 router = APIRouter()
 
 
 @router.get("/events")
-async def get_event(companyId: int = None, db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> list[Event]:
+def get_event(request: Request, response: Response, companyId: int = None, from_date: int = Query(default=None, alias="from"), to_date: int = Query(default=None, alias="to"), planning_id: int = None, owner_id: int = None, fields: str = None, cursor: str = None, limit: int = Query(default=None, ge=1, le=MAX_PAGE_SIZE), db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> list[Event]:
     """
     Récupérer tout les événements de son entreprise.\n
-    Les MAINTAINER peuvent filtrer par company_id.
+    Les MAINTAINER peuvent filtrer par company_id.\n
+    from / to (timestamps en secondes) filtrent les événements qui
+    chevauchent cette période, planning_id et owner_id sont aussi filtrables.\n
+    fields liste les champs à renvoyer, ceux des participants sous la forme
+    users.first_name (par exemple id,name,users.accepted), les id sont
+    toujours renvoyés.\n
+    Pagination: limit donne la taille de la page, le curseur de la page
+    suivante est renvoyé dans le header X-Next-Cursor (paramètre cursor).\n
+    Avec le header Accept: application/x-ndjson, les événements sont envoyés
+    en flux, un par ligne.
     """
+    notModified = not_modified(db, request, response, authUser)
+    if notModified:
+        return notModified
+
     show_all = False if authUser["role"] != "MAINTAINER" else True
 
     company_id = authUser["company_id"]
@@ -34,47 +56,55 @@ async def get_event(companyId: int = None, db: Session = Depends(get_db), authUs
             if (not db_company):
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="Company not found")
-    if (company_id == None):
-        db_events = db.query(EventEntity).outerjoin(PlanningEntity).all()
-    else:
-        db_events = db.query(EventEntity).outerjoin(PlanningEntity).filter_by(
-            company_id=company_id).all()
-
-    users = await get_users(db)
-
-    db_events_dict = [event.__dict__ for event in db_events]
-    for event in db_events_dict:
-        planning = db.query(PlanningEntity).filter_by(
-            id=event["planning_id"]).first()
-        if (planning): planning = planning.__dict__
-        event["name"] = decrypt(event["name"])
-        event["place"] = decrypt(event["place"])
-        event["start_date"] = datetime.datetime.timestamp(event["start_date"])
-        event["end_date"] = datetime.datetime.timestamp(event["end_date"])
-        event["company_id"] = planning["company_id"] if planning else None
-        event["created_at"] = datetime.datetime.timestamp(event["created_at"])
-        event["updated_at"] = datetime.datetime.timestamp(event["updated_at"])
-        events_users = db.query(UserEventEntity).filter_by(
-            event_id=event["id"]).all()
-        events_users_dict = [
-            event_user.__dict__ for event_user in events_users]
-        event["users"] = []
-        for event_user in events_users_dict:
-            user = next(
-                (user for user in users if user["id"] == event_user["user_id"]), None)
-            user["accepted"] = event_user["accepted"]
-            user["added_at"] = datetime.datetime.timestamp(
-                event_user["added_at"])
-            user["updated_at"] = datetime.datetime.timestamp(
-                event_user["updated_at"])
-            user["email"] = user["email"] if show_all else ""
-            event["users"].append(user)
-
-    return db_events_dict
+    try:
+        fromDate = datetime.datetime.fromtimestamp(
+            from_date) if from_date != None else None
+        toDate = datetime.datetime.fromtimestamp(
+            to_date) if to_date != None else None
+    except:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid date format, please use timestamp in seconds")
+    if (fromDate != None and toDate != None and fromDate >= toDate):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="from must be before to")
+
+    events_query = db.query(EventEntity.id).outerjoin(PlanningEntity)
+    if (company_id != None):
+        events_query = events_query.filter(
+            PlanningEntity.company_id == company_id)
+    if (planning_id != None):
+        events_query = events_query.filter(
+            EventEntity.planning_id == planning_id)
+    if (owner_id != None):
+        events_query = events_query.filter(EventEntity.owner_id == owner_id)
+    # events overlapping [from, to[
+    if (toDate != None):
+        events_query = events_query.filter(EventEntity.start_date < toDate)
+    if (fromDate != None):
+        events_query = events_query.filter(EventEntity.end_date > fromDate)
+    fieldset = parse_fields(fields, Event)
+    events_with_company_query = events_query.with_entities(
+        EventEntity, PlanningEntity.company_id)
+    columns = fieldset_columns(EventEntity, fieldset, "id")
+    if columns:
+        events_with_company_query = events_with_company_query.options(
+            load_only(*columns))
+
+    if wants_ndjson(request):
+        return stream_ndjson(
+            keyset(events_with_company_query, EventEntity.id, cursor).limit(limit),
+            lambda db_events: serialize_events(db, db_events, events_query, company_id, show_all, fieldset))
+
+    db_events = paginate(
+        events_with_company_query, EventEntity.id, cursor, limit, response,
+        row_id=lambda row: row[0].id
+    )
+
+    return trusted_response(serialize_events(db, db_events, events_query, company_id, show_all, fieldset), response)
 
 
 @router.post("/event", status_code=status.HTTP_201_CREATED)
-async def create_event(event: EventChangeableFields, db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> Event:
+def create_event(event: EventChangeableFields, db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> Event:
     """
     Créer une activité.\n
     Les MAINTAINER peuvent créer des activités pour n'importe quelle entreprise.
@@ -111,10 +141,10 @@ async def create_event(event: EventChangeableFields, db: Session = Depends(get_d
         owner_id=authUser["id"]
     )
     db.add(db_event)
-    db.commit()
-    db.refresh(db_event)
+    # the id of the event is needed by the owner participation
+    db.flush()
 
-    now = datetime.datetime.now()
+    now = datetime.datetime.utcnow()
     db_event_user_relation = UserEventEntity(
         event_id=db_event.id,
         user_id=authUser["id"],
@@ -124,15 +154,21 @@ async def create_event(event: EventChangeableFields, db: Session = Depends(get_d
     )
 
     db.add(db_event_user_relation)
+    bump_version(db, planning.company_id)
     db.commit()
-    db.refresh(db_event_user_relation)
 
-    user = await get_user_by_id(authUser["id"], db)
+    user = dict(
+        id=authUser["id"],
+        first_name=authUser["first_name"],
+        last_name=authUser["last_name"],
+        email=authUser["email"],
+        role=authUser["role"]
+    )
 
     db_event_decrypted = dict(
         id=db_event.id,
-        name=decrypt(db_event.name),
-        place=decrypt(db_event.place),
+        name=event.name,
+        place=event.place,
         start_date=datetime.datetime.timestamp(db_event.start_date),
         end_date=datetime.datetime.timestamp(db_event.end_date),
         planning_id=db_event.planning_id,
@@ -146,9 +182,10 @@ async def create_event(event: EventChangeableFields, db: Session = Depends(get_d
 
 
 @router.delete("/event/{eventId}")
-async def delete_event_by_id(eventId: int, db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> Event:
+def delete_event_by_id(eventId: int, response: Response, db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> Event:
     """
-    Supprimer un événement par son id.\n
+    Supprimer un événement par son id, avec ses participations.\n
+    Le nombre de lignes supprimées par table est renvoyé dans le header X-Deleted-Counts.\n
     Vous devez être le propriétaire de l'événement ou un maintainer.
     """
 
@@ -166,8 +203,8 @@ async def delete_event_by_id(eventId: int, db: Session = Depends(get_db), authUs
     if db_event == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Event not found")
-    db.delete(db_event)
-    db.commit()
+    company_id = db.query(PlanningEntity.company_id).filter_by(
+        id=db_event.planning_id).scalar()
 
     old_event = Event(
         id=db_event.id,
@@ -181,11 +218,15 @@ async def delete_event_by_id(eventId: int, db: Session = Depends(get_db), authUs
         updated_at=datetime.datetime.timestamp(db_event.updated_at)
     )
 
+    counts = delete_event(db, eventId, company_id)
+    db.commit()
+    response.headers[DELETED_COUNTS_HEADER] = format_counts(counts)
+
     return old_event.__dict__
 
 
 @router.patch("/event/{eventId}")
-async def update_event_by_id(eventId: int, event: EventChangeableFields, db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> Event:
+def update_event_by_id(eventId: int, event: EventChangeableFields, db: Session = Depends(get_db), authUser: Annotated[Event, Depends(decode_token)] = None) -> Event:
     """
     Mettre à jour un événement par son id.\n
     Vous devez être le propriétaire de l'événement
@@ -208,15 +249,31 @@ async def update_event_by_id(eventId: int, event: EventChangeableFields, db: Ses
         event.start_date) if event.start_date != None else db_event.start_date
     db_event.end_date = datetime.datetime.fromtimestamp(
         event.end_date) if event.end_date != None else db_event.end_date
+    # the event can move to a planning of another company
+    company_ids = dict(db.query(PlanningEntity.id, PlanningEntity.company_id).filter(
+        PlanningEntity.id.in_([db_event.planning_id, event.planning_id])))
+    old_company_id = company_ids.get(db_event.planning_id)
     db_event.planning_id = event.planning_id if event.planning_id != None else db_event.planning_id
-    db_event.updated_at = datetime.datetime.now()
+    new_company_id = company_ids.get(db_event.planning_id)
+    now = datetime.datetime.utcnow()
+    db_event.updated_at = now
+    if new_company_id != old_company_id:
+        # the event and its attendees leave the data of the old company,
+        # and are sent again to the new one
+        user_event_ids = [id for id, in db.query(
+            UserEventEntity.id).filter_by(event_id=eventId)]
+        if old_company_id != None:
+            record_deletions(db, "events", [eventId], old_company_id)
+            record_deletions(db, "user_event", user_event_ids, old_company_id)
+        db.query(UserEventEntity).filter_by(event_id=eventId).update(
+            {UserEventEntity.updated_at: now}, synchronize_session=False)
+    bump_version(db, old_company_id, new_company_id)
     db.commit()
-    db.refresh(db_event)
 
     db_user_decrypted = dict(
         id=db_event.id,
-        name=decrypt(db_event.name),
-        place=decrypt(db_event.place),
+        name=event.name if event.name != None else decrypt(db_event.name),
+        place=event.place if event.place != None else decrypt(db_event.place),
         start_date=datetime.datetime.timestamp(db_event.start_date),
         end_date=datetime.datetime.timestamp(db_event.end_date),
         planning_id=db_event.planning_id,
@@ -229,7 +286,7 @@ async def update_event_by_id(eventId: int, event: EventChangeableFields, db: Ses
 
 
 @router.get("/event-add-user/{eventId}")
-async def add_user_to_event(eventId: int, userId: int = None, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> DefaultResponse:
+def add_user_to_event(eventId: int, userId: int = None, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> DefaultResponse:
     """
     Ajouter un utilisateur à une activité,
     userId non requis si vous souhaitez vous ajouter vous-même.
@@ -249,18 +306,6 @@ async def add_user_to_event(eventId: int, userId: int = None, db: Session = Depe
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Event not found")
 
-    db_users_in_event = db.query(UserEventEntity).filter_by(
-        event_id=eventId).all()
-    userIsAlreadyInEvent = False
-    for userEvent in db_users_in_event:
-        if userEvent.user_id == db_user.id:
-            userIsAlreadyInEvent = True
-            break
-
-    if userIsAlreadyInEvent:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                            detail="User is already in the event")
-
     db_planning = db.query(PlanningEntity).filter_by(
         id=db_event.planning_id).first()
 
@@ -271,24 +316,29 @@ async def add_user_to_event(eventId: int, userId: int = None, db: Session = Depe
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Unauthorized")
 
-    now = datetime.datetime.now()
-    db_event_user = UserEventEntity(
+    now = datetime.datetime.utcnow()
+    # the unique (event_id, user_id) index rejects the user if already in the event
+    inserted = insert_or_ignore(db, UserEventEntity, [dict(
         user_id=db_user.id,
         event_id=db_event.id,
         accepted=False if db_user.id != authUser["id"] else True,
         added_at=now,
         updated_at=now
-    )
+    )], ["event_id", "user_id"])
+
+    if not inserted:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="User is already in the event")
 
-    db.add(db_event_user)
+    bump_version(db, db_planning.company_id)
     db.commit()
-    db.refresh(db_event_user)
 
     return {"success": True}
 
 
 @router.get("/event-remove-user/{eventId}")
-async def remove_user_from_event(eventId: int, userId: int = None, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> DefaultResponse:
+def remove_user_from_event(eventId: int, userId: int = None, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> DefaultResponse:
     """
     Supprimer un utilisateur d'une activité.\n
     userId non requis si vous souhaitez vous supprimer vous-même.
@@ -308,15 +358,10 @@ async def remove_user_from_event(eventId: int, userId: int = None, db: Session =
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Event not found")
 
-    db_users_in_event = db.query(UserEventEntity).filter_by(
-        event_id=eventId).all()
-    userIsAlreadyInEvent = False
-    for userEvent in db_users_in_event:
-        if userEvent.user_id == db_user.id:
-            userIsAlreadyInEvent = True
-            break
+    db_event_user_id = db.query(UserEventEntity.id).filter_by(
+        event_id=eventId, user_id=db_user.id).scalar()
 
-    if not userIsAlreadyInEvent:
+    if db_event_user_id == None:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail="User is not in the event")
 
@@ -330,15 +375,141 @@ async def remove_user_from_event(eventId: int, userId: int = None, db: Session =
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Unauthorized")
 
-    db.query(UserEventEntity).filter_by(
-        user_id=db_user.id, event_id=db_event.id).delete()
+    db.query(UserEventEntity).filter_by(id=db_event_user_id).delete()
+    record_deletions(db, "user_event", [
+                     db_event_user_id], db_planning.company_id)
+    bump_version(db, db_planning.company_id)
     db.commit()
 
     return {"success": True}
 
 
+def get_attendee_candidates(db: Session, eventId: int, user_ids: list, authUser: dict) -> tuple:
+    """
+    Company of the event and the given users found, with their company
+    and their participation to the event (None when not in the event).\n
+    The event must be in a planning of your company, unless you are MAINTAINER.
+    """
+    db_event = db.query(EventEntity.id, PlanningEntity.id.label("planning_id"), PlanningEntity.company_id).outerjoin(
+        PlanningEntity).filter(EventEntity.id == eventId).first()
+
+    if db_event == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Event not found")
+    if db_event.planning_id == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="The event is not in a planning")
+    elif db_event.company_id != authUser["company_id"] and authUser["role"] != "MAINTAINER":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Unauthorized")
+
+    # users, their scope and their participation in one query
+    db_users = (
+        db.query(UserEntity.id, UserEntity.company_id, UserEventEntity.id.label("user_event_id"))
+        .outerjoin(UserEventEntity, and_(UserEventEntity.user_id == UserEntity.id, UserEventEntity.event_id == eventId))
+        .filter(UserEntity.id.in_(user_ids))
+        .all()
+    )
+    return db_event.company_id, {db_user.id: db_user for db_user in db_users}
+
+
+def attendee_status(db_user, authUser: dict) -> str:
+    if db_user == None:
+        return "not_found"
+    if db_user.company_id != authUser["company_id"] and authUser["role"] != "MAINTAINER":
+        return "unauthorized"
+    return None
+
+
+@router.post("/event/{eventId}/attendees")
+def add_attendees(eventId: int, attendees: Attendees, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> AttendeesReport:
+    """
+    Ajouter des utilisateurs (user_ids) à une activité.\n
+    Renvoie le résultat pour chaque utilisateur : added, already_in_event,
+    not_found ou unauthorized (utilisateur d'une autre entreprise).
+    """
+    user_ids = list(dict.fromkeys(attendees.user_ids))
+    company_id, db_users = get_attendee_candidates(
+        db, eventId, user_ids, authUser)
+
+    results = []
+    added = []
+    for user_id in user_ids:
+        db_user = db_users.get(user_id)
+        user_status = attendee_status(db_user, authUser)
+        if user_status == None:
+            user_status = "already_in_event" if db_user.user_event_id != None else "added"
+        if user_status == "added":
+            added.append(user_id)
+        results.append(dict(user_id=user_id, status=user_status))
+
+    if added:
+        now = datetime.datetime.utcnow()
+        # users added concurrently since the lookup are skipped by the unique index
+        inserted = insert_or_ignore(db, UserEventEntity, [
+            dict(
+                user_id=user_id,
+                event_id=eventId,
+                accepted=user_id == authUser["id"],
+                added_at=now,
+                updated_at=now
+            )
+            for user_id in added
+        ], ["event_id", "user_id"])
+        if inserted != len(added):
+            # their rows are the ones not added now
+            concurrent = {user_id for user_id, in db.query(UserEventEntity.user_id).filter(
+                UserEventEntity.event_id == eventId,
+                UserEventEntity.user_id.in_(added),
+                UserEventEntity.added_at != now)}
+            for result in results:
+                if result["user_id"] in concurrent:
+                    result["status"] = "already_in_event"
+            added = [user_id for user_id in added if user_id not in concurrent]
+        if added:
+            bump_version(db, company_id)
+        db.commit()
+
+    return dict(changed=len(added), results=results)
+
+
+@router.delete("/event/{eventId}/attendees")
+def remove_attendees(eventId: int, attendees: Attendees, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> AttendeesReport:
+    """
+    Supprimer des utilisateurs (user_ids) d'une activité.\n
+    Renvoie le résultat pour chaque utilisateur : removed, not_in_event,
+    not_found ou unauthorized (utilisateur d'une autre entreprise).
+    """
+    user_ids = list(dict.fromkeys(attendees.user_ids))
+    company_id, db_users = get_attendee_candidates(
+        db, eventId, user_ids, authUser)
+
+    results = []
+    removed = []
+    for user_id in user_ids:
+        db_user = db_users.get(user_id)
+        user_status = attendee_status(db_user, authUser)
+        if user_status == None:
+            user_status = "removed" if db_user.user_event_id != None else "not_in_event"
+        if user_status == "removed":
+            removed.append(db_user)
+        results.append(dict(user_id=user_id, status=user_status))
+
+    if removed:
+        db.query(UserEventEntity).filter(
+            UserEventEntity.event_id == eventId,
+            UserEventEntity.user_id.in_([db_user.id for db_user in removed])
+        ).delete(synchronize_session=False)
+        record_deletions(db, "user_event", [
+                         db_user.user_event_id for db_user in removed], company_id)
+        bump_version(db, company_id)
+        db.commit()
+
+    return dict(changed=len(removed), results=results)
+
+
 @router.get("/event-accept-invite/{eventId}")
-async def accept_invite(eventId: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> DefaultResponse:
+def accept_invite(eventId: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> DefaultResponse:
     """
     Accepter une invitation à une activitée.
     """
@@ -348,13 +519,8 @@ async def accept_invite(eventId: int, db: Session = Depends(get_db), authUser: A
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Event not found")
 
-    db_users_in_event = db.query(UserEventEntity).filter_by(
-        event_id=eventId).all()
-    userAlreadyAcceptedEvent = False
-    for userEvent in db_users_in_event:
-        if userEvent.user_id == authUser["id"] and userEvent.accepted == True:
-            userAlreadyAcceptedEvent = True
-            break
+    userAlreadyAcceptedEvent = db.query(UserEventEntity.accepted).filter_by(
+        event_id=eventId, user_id=authUser["id"]).scalar()
 
     if userAlreadyAcceptedEvent:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
@@ -362,6 +528,8 @@ async def accept_invite(eventId: int, db: Session = Depends(get_db), authUser: A
 
     db.query(UserEventEntity).filter_by(
         user_id=authUser["id"], event_id=db_event.id).update({UserEventEntity.accepted: True})
+    bump_version(db, db.query(PlanningEntity.company_id).filter_by(
+        id=db_event.planning_id).scalar())
     db.commit()
 
     return {"success": True}
@@ -2,46 +2,68 @@
 from typing import Annotated
 import datetime
 # Libs Imports
-from fastapi import APIRouter, status, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, status, HTTPException, Query, Request, Response
+from sqlalchemy.orm import Session, load_only
 from fastapi import Depends
 # Local Imports
 from models.planning import Planning, PlanningChangeableFields
 from models.user import User
-from entities import Planning as PlanningEntity, Event as EventEntity
+from entities import Planning as PlanningEntity
 from dependencies import get_db
 from internals.auth import decode_token
+from internals.cascade import delete_planning, format_counts, DELETED_COUNTS_HEADER
+from internals.fieldsets import parse_fields, fieldset_columns
+from internals.pagination import keyset, paginate, MAX_PAGE_SIZE
+from internals.responses import trusted_response
+from internals.streaming import wants_ndjson, stream_ndjson
+from internals.versioning import bump_version, not_modified
+from serializers import serialize_plannings
 from crypt import encrypt, decrypt
 
 router = APIRouter()
 
 
 @router.get("/plannings")
-async def get_plannings(company_id=None, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> list[Planning]:
+def get_plannings(request: Request, response: Response, company_id=None, fields: str = None, cursor: str = None, limit: int = Query(default=None, ge=1, le=MAX_PAGE_SIZE), db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> list[Planning]:
     """
     Récupère tout vos plannings.\n
-    Les maintainer peuvent filtrer par company_id.
+    Les maintainer peuvent filtrer par company_id.\n
+    fields liste les champs à renvoyer (par exemple id,name),
+    l'id est toujours renvoyé.\n
+    Pagination: limit donne la taille de la page, le curseur de la page
+    suivante est renvoyé dans le header X-Next-Cursor (paramètre cursor).\n
+    Avec le header Accept: application/x-ndjson, les plannings sont envoyés
+    en flux, un par ligne.
     """
+    notModified = not_modified(db, request, response, authUser)
+    if notModified:
+        return notModified
+
     company_id = authUser["company_id"] if authUser["role"] != "MAINTAINER" else company_id
     if (company_id == None):
-        db_plannings = db.query(PlanningEntity).all()
+        plannings_query = db.query(PlanningEntity)
     else:
-        db_plannings = db.query(PlanningEntity).filter_by(
-            company_id=company_id).all()
-    db_plannings_dict = [planning.__dict__ for planning in db_plannings]
+        plannings_query = db.query(PlanningEntity).filter_by(
+            company_id=company_id)
+
+    fieldset = parse_fields(fields, Planning)
+    columns = fieldset_columns(PlanningEntity, fieldset, "id")
+    if columns:
+        plannings_query = plannings_query.options(load_only(*columns))
+
+    if wants_ndjson(request):
+        return stream_ndjson(
+            keyset(plannings_query, PlanningEntity.id, cursor).limit(limit),
+            lambda db_plannings: serialize_plannings(db_plannings, fieldset))
 
-    for planning in db_plannings_dict:
-        planning["name"] = decrypt(planning["name"])
-        planning["created_at"] = datetime.datetime.timestamp(
-            planning["created_at"])
-        planning["updated_at"] = datetime.datetime.timestamp(
-            planning["updated_at"])
+    db_plannings = paginate(
+        plannings_query, PlanningEntity.id, cursor, limit, response)
 
-    return db_plannings_dict
+    return trusted_response(serialize_plannings(db_plannings, fieldset), response)
 
 
 @router.post("/planning", status_code=status.HTTP_201_CREATED)
-async def create_planning(planning: PlanningChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Planning:
+def create_planning(planning: PlanningChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Planning:
     """
     Créer un planning (ADMIN ou MAINTAINER).\n
     Les MAINTAINER peuvent créer des plannings en ajoutant un company_id.
@@ -76,12 +98,12 @@ async def create_planning(planning: PlanningChangeableFields, db: Session = Depe
     )
 
     db.add(db_planning)
+    bump_version(db, company_id)
     db.commit()
-    db.refresh(db_planning)
 
     db_planning_decrypted = dict(
         id=db_planning.id,
-        name=decrypt(db_planning.name),
+        name=planning.name,
         company_id=db_planning.company_id
     )
 
@@ -89,9 +111,10 @@ async def create_planning(planning: PlanningChangeableFields, db: Session = Depe
 
 
 @router.delete("/planning/{planningId}")
-async def delete_planning_by_id(planningId: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Planning:
+def delete_planning_by_id(planningId: int, response: Response, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Planning:
     """
-    Supprimer un planning via son id.\n
+    Supprimer un planning via son id, avec ses événements.\n
+    Le nombre de lignes supprimées par table est renvoyé dans le header X-Deleted-Counts.\n
     Rôle ADMIN ou MAINTAINER requis.
     """
     if (authUser["role"] == "USER"):
@@ -106,13 +129,6 @@ async def delete_planning_by_id(planningId: int, db: Session = Depends(get_db),
     elif (authUser["role"] != "MAINTAINER" and authUser["company_id"] != db_planning.company_id):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
-    
-    events = db.query(EventEntity).filter_by(planning_id=planningId).all()
-    for event in events:
-        db.delete(event)
-
-    db.delete(db_planning)
-    db.commit()
 
     old_db_planning = Planning(
         id=db_planning.id,
@@ -122,11 +138,15 @@ async def delete_planning_by_id(planningId: int, db: Session = Depends(get_db),
         updated_at=datetime.datetime.timestamp(db_planning.updated_at)
     )
 
+    counts = delete_planning(db, planningId, db_planning.company_id)
+    db.commit()
+    response.headers[DELETED_COUNTS_HEADER] = format_counts(counts)
+
     return old_db_planning.__dict__
 
 
 @router.patch("/planning/{planningId}")
-async def update_planning_by_id(planningId: int, planning: PlanningChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Planning:
+def update_planning_by_id(planningId: int, planning: PlanningChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> Planning:
     """
     Mettre à jour une entreprise via son id.\n
     Rôle ADMIN ou MAINTAINER requis.
@@ -146,13 +166,13 @@ async def update_planning_by_id(planningId: int, planning: PlanningChangeableFie
 
     db_planning.name = encrypt(
         planning.name) if planning.name else db_planning.name
-    db_planning.updated_at = datetime.datetime.now()
+    db_planning.updated_at = datetime.datetime.utcnow()
+    bump_version(db, db_planning.company_id)
     db.commit()
-    db.refresh(db_planning)
 
     db_company_decrypted = dict(
         id=db_planning.id,
-        name=decrypt(db_planning.name),
+        name=planning.name if planning.name else decrypt(db_planning.name),
         company_id=db_planning.company_id,
         created_at=datetime.datetime.timestamp(db_planning.created_at),
         updated_at=datetime.datetime.timestamp(db_planning.updated_at)
@@ -0,0 +1,102 @@
+# System Imports
+from typing import Annotated
+import datetime
+import os
+# Libs Imports
+from fastapi import APIRouter, Response
+from sqlalchemy.orm import Session
+from fastapi import Depends
+# Local Imports
+from entities import User as UserEntity, Company as CompanyEntity, Planning as PlanningEntity, Event as EventEntity, UserEvent as UserEventEntity, Tombstone as TombstoneEntity
+from models.sync import SyncChanges
+from models.user import User
+from serializers import serialize_users, serialize_plannings, serialize_companies, serialize_events, serialize_user_events, serialize_tombstones
+from dependencies import get_db
+from internals.auth import decode_token
+from internals.responses import trusted_response
+from internals.sync import encode_sync_token, decode_sync_token
+
+router = APIRouter()
+
+# the token is this long before the start of the request: a change whose updated_at
+# was set before the request but which was committed after it is sent again by the next
+# sync, must be longer than the longest write transaction
+SYNC_SAFETY_MARGIN = datetime.timedelta(
+    seconds=int(os.environ.get("SYNC_SAFETY_MARGIN", 60)))
+
+
+@router.get("/sync")
+def sync(response: Response, since: str = None, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> SyncChanges:
+    """
+    Synchronisation incrémentale.\n
+    Renvoie les utilisateurs, entreprises, plannings, événements et participations
+    créés ou modifiés, ainsi que les suppressions, depuis le token since.\n
+    Sans since, tout est renvoyé. Utilisez le token de la réponse pour la prochaine synchronisation.\n
+    Les dernières modifications peuvent être renvoyées deux fois, les données sont
+    à fusionner par id.\n
+    Seules les données de votre entreprise sont renvoyées, sauf si vous êtes MAINTAINER.
+    """
+    # taken before reading, with a margin for the transactions still running
+    token = encode_sync_token(datetime.datetime.utcnow() - SYNC_SAFETY_MARGIN)
+    since_date = decode_sync_token(since) if since else datetime.datetime.min
+    show_all = authUser["role"] == "MAINTAINER"
+    company_id = None if show_all else authUser["company_id"]
+
+    # without company there is nothing to see, as for GET /users
+    if not show_all and company_id == None:
+        return trusted_response(dict(
+            token=token, users=[], companies=[], plannings=[], events=[],
+            user_event=[], deleted=[]
+        ), response)
+
+    users_query = db.query(UserEntity).filter(
+        UserEntity.updated_at >= since_date)
+    companies_query = db.query(CompanyEntity).filter(
+        CompanyEntity.updated_at >= since_date)
+    plannings_query = db.query(PlanningEntity).filter(
+        PlanningEntity.updated_at >= since_date)
+    events_query = db.query(EventEntity.id).outerjoin(PlanningEntity).filter(
+        EventEntity.updated_at >= since_date)
+    user_event_query = (
+        db.query(UserEventEntity)
+        .join(EventEntity, EventEntity.id == UserEventEntity.event_id)
+        .outerjoin(PlanningEntity)
+        .filter(UserEventEntity.updated_at >= since_date)
+    )
+    tombstones_query = db.query(TombstoneEntity).filter(
+        TombstoneEntity.deleted_at >= since_date)
+    if not show_all:
+        users_query = users_query.filter(UserEntity.company_id == company_id)
+        companies_query = companies_query.filter(CompanyEntity.id == company_id)
+        plannings_query = plannings_query.filter(
+            PlanningEntity.company_id == company_id)
+        events_query = events_query.filter(
+            PlanningEntity.company_id == company_id)
+        user_event_query = user_event_query.filter(
+            PlanningEntity.company_id == company_id)
+        tombstones_query = tombstones_query.filter(
+            TombstoneEntity.company_id == company_id)
+
+    db_events = (
+        events_query
+        .with_entities(EventEntity, PlanningEntity.company_id)
+        .order_by(EventEntity.id)
+        .all()
+    )
+
+    return trusted_response(dict(
+        token=token,
+        users=serialize_users(
+            users_query.order_by(UserEntity.id).all(), authUser["role"] != "USER"),
+        companies=serialize_companies(
+            companies_query.order_by(CompanyEntity.id).all(), show_all,
+            include_users=False, include_plannings=False),
+        plannings=serialize_plannings(
+            plannings_query.order_by(PlanningEntity.id).all()),
+        events=serialize_events(
+            db, db_events, events_query, company_id, show_all),
+        user_event=serialize_user_events(
+            user_event_query.order_by(UserEventEntity.id).all()),
+        deleted=serialize_tombstones(
+            tombstones_query.order_by(TombstoneEntity.id).all())
+    ), response)
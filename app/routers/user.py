@@ -1,31 +1,59 @@
 # System Imports
 from typing import Annotated
+import csv
 import datetime
+import io
+import json
 # Libs Imports
-from fastapi import APIRouter, status, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, status, HTTPException, Query, Request, Response
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, load_only
 from fastapi import Depends
 # Local Imports
-from entities import User as UserEntity, UserEvent as UserEventEntity
-from models.user import User, UserChangeableFields
-from dependencies import get_db
-from internals.auth import decode_token
-from crypt import encrypt, decrypt, hash_password
+from entities import User as UserEntity, Company as CompanyEntity
+from models.user import User, UserChangeableFields, UserImport, UserImportReport
+from dependencies import get_db, get_body
+from internals.auth import decode_token, invalidate_principal
+from internals.cascade import delete_user, format_counts, DELETED_COUNTS_HEADER
+from internals.directory import invalidate_directory
+from internals.fieldsets import parse_fields, fieldset_columns
+from internals.pagination import keyset, paginate, MAX_PAGE_SIZE
+from internals.responses import trusted_response
+from internals.streaming import wants_ndjson, stream_ndjson, NDJSON_MEDIA_TYPE
+from internals.versioning import bump_version, not_modified, attended_company_ids
+from serializers import serialize_users
+from crypt import encrypt, encrypt_many, decrypt, hash_password, blind_index
 
 router = APIRouter()
 
+CSV_MEDIA_TYPE = "text/csv"
+# rows per duplicate lookup and per insert transaction of an import
+IMPORT_CHUNK_SIZE = 500
+
 
 @router.get("/users")
-async def get_users(db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> list[User]:
+def get_users(request: Request, response: Response, fields: str = None, cursor: str = None, limit: int = Query(default=None, ge=1, le=MAX_PAGE_SIZE), db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> list[User]:
     """
     Récupérer tout les utilisateurs.\n
     Vous devez être ADMIN ou MAINTAINER pour accéder à cette route.\n
-    Les ADMIN peuvent récupérer les utilisateurs de leur entreprise.
+    Les ADMIN peuvent récupérer les utilisateurs de leur entreprise.\n
+    fields liste les champs à renvoyer (par exemple id,first_name),
+    l'id est toujours renvoyé.\n
+    Pagination: limit donne la taille de la page, le curseur de la page
+    suivante est renvoyé dans le header X-Next-Cursor (paramètre cursor).\n
+    Avec le header Accept: application/x-ndjson, les utilisateurs sont envoyés
+    en flux, un par ligne.
     """
     if (authUser and authUser["role"] == "USER"):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
+    notModified = not_modified(db, request, response, authUser)
+    if notModified:
+        return notModified
+
     show_all = True if authUser and authUser["role"] != "MAINTAINER" else True
 
     # If the user is an ADMIN, we only return the users of his company
@@ -33,27 +61,41 @@ async def get_users(db: Session = Depends(get_db), authUser: Annotated[User, Dep
         if (authUser["company_id"] == None):
             return []
         admin_company_id = authUser["company_id"]
-        db_users = db.query(UserEntity).filter_by(
-            company_id=admin_company_id).all()
+        users_query = db.query(UserEntity).filter_by(
+            company_id=admin_company_id)
     else:
-        db_users = db.query(UserEntity).all()
+        users_query = db.query(UserEntity)
+
+    fieldset = parse_fields(fields, User)
+    columns = fieldset_columns(UserEntity, fieldset, "id")
+    if columns:
+        users_query = users_query.options(load_only(*columns))
+
+    if wants_ndjson(request):
+        return stream_ndjson(
+            keyset(users_query, UserEntity.id, cursor).limit(limit),
+            lambda db_users: serialize_users(db_users, show_all, fieldset))
 
-    db_users_dict = [user.__dict__ for user in db_users]
+    db_users = paginate(users_query, UserEntity.id, cursor, limit, response)
 
-    for user in db_users_dict:
-        user["first_name"] = decrypt(user["first_name"])
-        user["last_name"] = decrypt(user["last_name"])
-        user["email"] = decrypt(user["email"]) if show_all else ""
-        user["created_at"] = datetime.datetime.timestamp(
-            user["created_at"]) if show_all else 0
-        user["updated_at"] = datetime.datetime.timestamp(
-            user["updated_at"]) if show_all else 0
+    return trusted_response(serialize_users(db_users, show_all, fieldset), response)
 
-    return db_users_dict
+
+def decrypt_user(db_user: UserEntity) -> dict:
+    """
+    Decrypted dict of a user, as returned by the user routes
+    """
+    return dict(
+        id=db_user.id,
+        first_name=decrypt(db_user.first_name),
+        last_name=decrypt(db_user.last_name),
+        email=decrypt(db_user.email),
+        role=db_user.role
+    )
 
 
 @router.get("/users/search")
-async def get_user_by_id(id: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
+def get_user_by_id(id: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
     """
     Récupérer un utilisateur par son id.\n
     Vous devez être MAINTAINER pour accéder à cette route.
@@ -68,19 +110,11 @@ async def get_user_by_id(id: int, db: Session = Depends(get_db), authUser: Annot
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="User not found")
 
-    db_user_decrypted = dict(
-        id=db_user.id,
-        first_name=decrypt(db_user.first_name),
-        last_name=decrypt(db_user.last_name),
-        email=decrypt(db_user.email),
-        role=db_user.role
-    )
-
-    return db_user_decrypted
+    return decrypt_user(db_user)
 
 
 @router.post("/users", status_code=status.HTTP_201_CREATED)
-async def create_user(user: UserChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
+def create_user(user: UserChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
     """
     Créer un utilisateur.\n
     Vous devez être MAINTAINER pour accéder à cette route.\n
@@ -90,12 +124,9 @@ async def create_user(user: UserChangeableFields, db: Session = Depends(get_db),
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    allUsers = db.query(UserEntity).all()
-    isExistingUser = False
-    for db_user in allUsers:
-        if (decrypt(db_user.email) == user.email):
-            isExistingUser = True
-            break
+    email_index = blind_index(user.email)
+    isExistingUser = db.query(UserEntity.id).filter_by(
+        email_index=email_index).first() != None
     if isExistingUser:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="User already exists")
@@ -104,29 +135,153 @@ async def create_user(user: UserChangeableFields, db: Session = Depends(get_db),
         first_name=encrypt(user.first_name),
         last_name=encrypt(user.last_name),
         email=encrypt(user.email),
+        email_index=email_index,
         password_hash=hash_password(user.password_hash),
         role=user.role
     )
 
     db.add(db_user)
+    bump_version(db)
     db.commit()
-    db.refresh(db_user)
+    invalidate_directory(db_user.company_id)
 
     db_user_decrypted = dict(
         id=db_user.id,
-        first_name=decrypt(db_user.first_name),
-        last_name=decrypt(db_user.last_name),
-        email=decrypt(db_user.email),
+        first_name=user.first_name,
+        last_name=user.last_name,
+        email=user.email,
         role=db_user.role
     )
 
     return db_user_decrypted
 
 
+def parse_user_import(body: bytes, content_type: str) -> list:
+    """
+    Records of a CSV (with a header line) or NDJSON import body
+    """
+    try:
+        text = body.decode("utf-8-sig")
+        if content_type.startswith(CSV_MEDIA_TYPE):
+            # empty cells are missing values
+            return [
+                {key: value for key, value in record.items() if key != None and value not in (None, "")}
+                for record in csv.DictReader(io.StringIO(text))
+            ]
+        if content_type.startswith(NDJSON_MEDIA_TYPE):
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+    except (UnicodeDecodeError, ValueError, csv.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid import file")
+    raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                        detail="Content-Type must be text/csv or application/x-ndjson")
+
+
+def existing_email_indexes(db: Session, email_indexes: list) -> set:
+    """
+    The given blind indexes already used by a user
+    """
+    existing = set()
+    for i in range(0, len(email_indexes), IMPORT_CHUNK_SIZE):
+        existing.update(email_index for email_index, in db.query(UserEntity.email_index).filter(
+            UserEntity.email_index.in_(email_indexes[i:i + IMPORT_CHUNK_SIZE])))
+    return existing
+
+
+@router.post("/users/bulk")
+def import_users(request: Request, body: bytes = Depends(get_body), company_id: int = None, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> UserImportReport:
+    """
+    Importer des utilisateurs en masse.\n
+    Le corps est un fichier CSV (Content-Type: text/csv, avec une ligne d'en-tête)
+    ou NDJSON (Content-Type: application/x-ndjson) avec les champs first_name,
+    last_name, email, password_hash et role (USER par défaut).\n
+    company_id (optionnel) ajoute les utilisateurs à cette entreprise.\n
+    Renvoie le résultat de chaque ligne : created, duplicate ou invalid.\n
+    Vous devez être MAINTAINER pour accéder à cette route.
+    """
+    if (authUser["role"] != "MAINTAINER"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+
+    if company_id != None and db.query(CompanyEntity.id).filter_by(id=company_id).first() == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Company not found")
+
+    records = parse_user_import(body, request.headers.get("content-type", ""))
+
+    results = []
+    valid = []
+    for row, record in enumerate(records, start=1):
+        try:
+            user = UserImport.parse_obj(record)
+        except (ValidationError, TypeError) as error:
+            results.append(dict(row=row, email=record.get("email") if isinstance(record, dict) else None,
+                                status="invalid", detail=str(error).replace("\n", " ")))
+            continue
+        result = dict(row=row, email=user.email, status="created")
+        results.append(result)
+        valid.append((result, user, blind_index(user.email)))
+
+    # duplicates, in the file and in the database, in one pass
+    existing = existing_email_indexes(
+        db, list({email_index for _, _, email_index in valid}))
+    new_users = []
+    for result, user, email_index in valid:
+        if email_index in existing:
+            result["status"] = "duplicate"
+            result["detail"] = "User already exists"
+        else:
+            existing.add(email_index)
+            new_users.append((result, user, email_index))
+
+    for i in range(0, len(new_users), IMPORT_CHUNK_SIZE):
+        chunk = new_users[i:i + IMPORT_CHUNK_SIZE]
+        first_names = encrypt_many([user.first_name for _, user, _ in chunk])
+        last_names = encrypt_many([user.last_name for _, user, _ in chunk])
+        emails = encrypt_many([user.email for _, user, _ in chunk])
+        now = datetime.datetime.utcnow()
+        db.execute(insert(UserEntity), [
+            dict(
+                first_name=first_names[j],
+                last_name=last_names[j],
+                email=emails[j],
+                email_index=email_index,
+                password_hash=hash_password(user.password_hash),
+                role=user.role.value,
+                company_id=company_id,
+                created_at=now,
+                updated_at=now
+            )
+            for j, (_, user, email_index) in enumerate(chunk)
+        ])
+        bump_version(db, company_id)
+        try:
+            db.commit()
+        except IntegrityError:
+            # users created by another request since the duplicate check,
+            # the rows of the previous chunks are kept and reported as duplicates on retry
+            db.rollback()
+            invalidate_directory(company_id)
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="Users were created concurrently, please retry the import")
+
+        ids = dict(db.query(UserEntity.email_index, UserEntity.id).filter(
+            UserEntity.email_index.in_([email_index for _, _, email_index in chunk])))
+        for result, _, email_index in chunk:
+            result["id"] = ids[email_index]
+
+    if new_users:
+        invalidate_directory(company_id)
+
+    created = len(new_users)
+    return dict(created=created, failed=len(results) - created, results=results)
+
+
 @router.delete("/users/{userId}")
-async def delete_user_by_id(userId: int, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
+def delete_user_by_id(userId: int, response: Response, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
     """
-    Supprimer un utilisateur par son id.\n
+    Supprimer un utilisateur par son id, avec ses participations et ses notifications.\n
+    Le nombre de lignes supprimées par table est renvoyé dans le header X-Deleted-Counts.\n
     Vous devez être MAINTAINER pour accéder à cette route.
     """
     if (authUser["role"] != "MAINTAINER"):
@@ -139,13 +294,6 @@ async def delete_user_by_id(userId: int, db: Session = Depends(get_db), authUser
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="User not found")
 
-    events_users = db.query(UserEventEntity).filter_by(user_id=userId).all()
-    for event_user in events_users:
-        db.delete(event_user)
-
-    db.delete(db_user)
-    db.commit()
-
     db_user_decrypted = dict(
         id=db_user.id,
         first_name=decrypt(db_user.first_name),
@@ -156,11 +304,18 @@ async def delete_user_by_id(userId: int, db: Session = Depends(get_db), authUser
         updated_at=datetime.datetime.timestamp(db_user.updated_at)
     )
 
+    company_id = db_user.company_id
+    counts = delete_user(db, userId, company_id)
+    db.commit()
+    invalidate_principal(userId)
+    invalidate_directory(company_id)
+    response.headers[DELETED_COUNTS_HEADER] = format_counts(counts)
+
     return db_user_decrypted
 
 
 @router.patch("/users/{userId}")
-async def update_user_by_id(userId: int, user: UserChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
+def update_user_by_id(userId: int, user: UserChangeableFields, db: Session = Depends(get_db), authUser: Annotated[User, Depends(decode_token)] = None) -> User:
     """
     Mettre à jour un utilisateur par son id.\n
     Les MAINTAINERS peuvent mettre à jour tous les utilisateurs.\n
@@ -176,6 +331,15 @@ async def update_user_by_id(userId: int, user: UserChangeableFields, db: Session
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="User not found")
 
+    if user.email is not None:
+        email_index = blind_index(user.email)
+        isExistingUser = db.query(UserEntity.id).filter(
+            UserEntity.email_index == email_index, UserEntity.id != userId).first() != None
+        if isExistingUser:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="User already exists")
+        db_user.email_index = email_index
+
     db_user.first_name = encrypt(
         user.first_name) if user.first_name is not None else db_user.first_name
     db_user.last_name = encrypt(
@@ -185,15 +349,19 @@ async def update_user_by_id(userId: int, user: UserChangeableFields, db: Session
     db_user.password_hash = hash_password(
         user.password_hash) if user.password_hash is not None else db_user.password_hash
     db_user.role = user.role if user.role is not None else db_user.role
-    db_user.updated_at = datetime.datetime.now()
+    db_user.updated_at = datetime.datetime.utcnow()
+    bump_version(db, db_user.company_id, *attended_company_ids(db, userId))
     db.commit()
-    db.refresh(db_user)
+    invalidate_principal(userId)
+    invalidate_directory(db_user.company_id)
 
     db_user_decrypted = dict(
         id=db_user.id,
-        first_name=decrypt(db_user.first_name),
-        last_name=decrypt(db_user.last_name),
-        email=decrypt(db_user.email),
+        first_name=user.first_name if user.first_name is not None else decrypt(
+            db_user.first_name),
+        last_name=user.last_name if user.last_name is not None else decrypt(
+            db_user.last_name),
+        email=user.email if user.email is not None else decrypt(db_user.email),
         role=db_user.role,
         created_at=datetime.datetime.timestamp(db_user.created_at),
         updated_at=datetime.datetime.timestamp(db_user.updated_at)
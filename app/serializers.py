@@ -0,0 +1,214 @@
+# System imports
+import datetime
+# Libs imports
+from sqlalchemy.orm import Session
+# Local imports
+from entities import UserEvent as UserEventEntity, Event as EventEntity
+from internals.directory import find_users
+from internals.fieldsets import wants, sub_fieldset
+from crypt import decrypt_many
+
+# Plain dicts of the entities, shaped like their response models (same fields,
+# same order, timestamps as int) so that they can be sent without validation.
+# The entities are only read, never modified.
+# With a fieldset (see internals.fieldsets), only its fields are decrypted and returned.
+
+
+def timestamp(date: datetime.datetime) -> int:
+    return int(datetime.datetime.timestamp(date))
+
+
+def project(rows: list, getters: dict, fieldset: dict = None) -> list:
+    """
+    Dicts of the rows with the fields of the fieldset (all of them without),
+    in the order of getters, each value being getter(index, row)
+    """
+    getters = [
+        (field, getter) for field, getter in getters.items() if wants(fieldset, field)]
+    return [
+        {field: getter(i, row) for field, getter in getters}
+        for i, row in enumerate(rows)
+    ]
+
+
+def decrypt_column(rows: list, field: str, fieldset: dict = None) -> list:
+    """
+    Decrypted values of the field of the rows, only when the fieldset wants it
+    """
+    if not wants(fieldset, field):
+        return None
+    return decrypt_many([getattr(row, field) for row in rows])
+
+
+def serialize_users(db_users: list, show_all: bool, fieldset: dict = None) -> list:
+    """
+    Decrypted dicts of the given users (models.user.User)
+    """
+    first_names = decrypt_column(db_users, "first_name", fieldset)
+    last_names = decrypt_column(db_users, "last_name", fieldset)
+    emails = decrypt_column(db_users, "email", fieldset) if show_all else None
+
+    return project(db_users, dict(
+        id=lambda i, user: user.id,
+        first_name=lambda i, user: first_names[i],
+        last_name=lambda i, user: last_names[i],
+        role=lambda i, user: user.role,
+        email=lambda i, user: emails[i] if show_all else "",
+        created_at=lambda i, user: timestamp(
+            user.created_at) if show_all else 0,
+        updated_at=lambda i, user: timestamp(
+            user.updated_at) if show_all else 0
+    ), fieldset)
+
+
+def serialize_plannings(db_plannings: list, fieldset: dict = None) -> list:
+    """
+    Decrypted dicts of the given plannings (models.planning.Planning)
+    """
+    names = decrypt_column(db_plannings, "name", fieldset)
+
+    return project(db_plannings, dict(
+        id=lambda i, planning: planning.id,
+        name=lambda i, planning: names[i],
+        company_id=lambda i, planning: planning.company_id,
+        created_at=lambda i, planning: timestamp(planning.created_at),
+        updated_at=lambda i, planning: timestamp(planning.updated_at)
+    ), fieldset)
+
+
+def serialize_companies(db_company: list, showAll: bool, include_users: bool = True, include_plannings: bool = True, fieldset: dict = None) -> list:
+    """
+    Decrypted dicts of the given companies (models.company.Company), with their
+    users and plannings when included (the collections must then be eager loaded)
+    """
+    include_users = include_users and wants(fieldset, "users")
+    include_plannings = include_plannings and wants(fieldset, "plannings")
+    users = [
+        user for company in db_company for user in company.users] if include_users else []
+    plannings = [
+        planning for company in db_company for planning in company.plannings] if include_plannings else []
+
+    names = decrypt_column(db_company, "name", fieldset)
+    websites = decrypt_column(db_company, "website", fieldset)
+    cities = decrypt_column(db_company, "city", fieldset)
+    countries = decrypt_column(db_company, "country", fieldset)
+    users_fieldset = sub_fieldset(fieldset, "users")
+    user_first_names = dict(zip(users, decrypt_column(
+        users, "first_name", users_fieldset) or []))
+    user_last_names = dict(zip(users, decrypt_column(
+        users, "last_name", users_fieldset) or []))
+    user_dicts = dict(zip(users, project(users, dict(
+        id=lambda i, user: user.id,
+        first_name=lambda i, user: user_first_names[user],
+        last_name=lambda i, user: user_last_names[user],
+        role=lambda i, user: user.role
+    ), users_fieldset)))
+    planning_dicts = dict(zip(plannings, serialize_plannings(
+        plannings, sub_fieldset(fieldset, "plannings"))))
+
+    return project(db_company, dict(
+        id=lambda i, company: company.id,
+        name=lambda i, company: names[i],
+        website=lambda i, company: websites[i],
+        city=lambda i, company: cities[i],
+        country=lambda i, company: countries[i],
+        users=lambda i, company: [
+            user_dicts[user] for user in company.users
+        ] if include_users else [],
+        plannings=lambda i, company: [
+            planning_dicts[planning] for planning in company.plannings
+        ] if include_plannings else [],
+        created_at=lambda i, company: timestamp(company.created_at),
+        updated_at=lambda i, company: timestamp(company.updated_at)
+    ), fieldset)
+
+
+def serialize_events(db: Session, db_events: list, events_query, company_id: int, show_all: bool, fieldset: dict = None) -> list:
+    """
+    Decrypted dicts of the given (event, company_id) rows (models.event.Event),
+    with their attendees.\n
+    The rows must be ordered by id and come from events_query.
+    """
+    if not db_events:
+        return []
+
+    events_users = dict()
+    users_by_id = dict()
+    if wants(fieldset, "users"):
+        # attendees of all the events at once, grouped by event
+        page_events_query = events_query.filter(EventEntity.id.between(
+            db_events[0][0].id, db_events[-1][0].id))
+        db_events_users = (
+            db.query(UserEventEntity)
+            .filter(UserEventEntity.event_id.in_(page_events_query))
+            .order_by(UserEventEntity.id)
+            .all()
+        )
+        for event_user in db_events_users:
+            events_users.setdefault(event_user.event_id, []).append(event_user)
+
+        users_by_id = find_users(
+            db, [event_user.user_id for event_user in db_events_users], company_id)
+
+    events = [event for event, _ in db_events]
+    names = decrypt_column(events, "name", fieldset)
+    places = decrypt_column(events, "place", fieldset)
+    users_getters = dict(
+        id=lambda i, event_user: event_user.user_id,
+        first_name=lambda i, event_user: users_by_id[event_user.user_id]["first_name"],
+        last_name=lambda i, event_user: users_by_id[event_user.user_id]["last_name"],
+        email=lambda i, event_user: users_by_id[event_user.user_id]["email"] if show_all else "",
+        role=lambda i, event_user: users_by_id[event_user.user_id]["role"],
+        accepted=lambda i, event_user: event_user.accepted,
+        added_at=lambda i, event_user: timestamp(event_user.added_at),
+        accepted_at=lambda i, event_user: None
+    )
+    users_fieldset = sub_fieldset(fieldset, "users")
+
+    return project(db_events, dict(
+        id=lambda i, row: row[0].id,
+        name=lambda i, row: names[i],
+        place=lambda i, row: places[i],
+        start_date=lambda i, row: timestamp(row[0].start_date),
+        end_date=lambda i, row: timestamp(row[0].end_date),
+        planning_id=lambda i, row: row[0].planning_id,
+        users=lambda i, row: project([
+            event_user for event_user in events_users.get(row[0].id, [])
+            if event_user.user_id in users_by_id
+        ], users_getters, users_fieldset),
+        owner_id=lambda i, row: row[0].owner_id,
+        company_id=lambda i, row: row[1],
+        created_at=lambda i, row: timestamp(row[0].created_at),
+        updated_at=lambda i, row: timestamp(row[0].updated_at)
+    ), fieldset)
+
+
+def serialize_user_events(db_user_events: list) -> list:
+    """
+    Dicts of the given participations (models.sync.UserEventChange)
+    """
+    return [
+        dict(
+            id=user_event.id,
+            user_id=user_event.user_id,
+            event_id=user_event.event_id,
+            accepted=user_event.accepted,
+            added_at=timestamp(user_event.added_at),
+            updated_at=timestamp(user_event.updated_at)
+        )
+        for user_event in db_user_events
+    ]
+
+
+def serialize_tombstones(db_tombstones: list) -> list:
+    """
+    Dicts of the given tombstones (models.sync.Deletion)
+    """
+    return [
+        dict(
+            entity=tombstone.entity,
+            id=tombstone.entity_id,
+            deleted_at=timestamp(tombstone.deleted_at)
+        )
+        for tombstone in db_tombstones
+    ]
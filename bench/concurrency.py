@@ -0,0 +1,101 @@
+"""
+Latency of small requests (GET /plannings) while big listings (GET /users)
+run on the same server, for each THREADPOOL_SIZE given.
+
+    python bench/concurrency.py --users 20000 --threadpool-sizes 1,10,30
+
+Each run starts uvicorn on a copy of the default database.
+"""
+# System Imports
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+# Libs Imports
+import httpx
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+PORT = 8765
+
+
+async def wait_for_server(client: httpx.AsyncClient):
+    for _ in range(100):
+        try:
+            await client.get("/docs")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("the server didn't start")
+
+
+async def measure(users: int, big_requests: int, small_requests: int) -> dict:
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", timeout=300) as client:
+        await wait_for_server(client)
+        response = await client.post("/login", data={"username": "admin@cp.cp", "password": "admin"})
+        headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+        body = "\n".join(json.dumps(dict(
+            first_name=f"first {i}", last_name=f"last {i}",
+            email=f"user{i}@bench.bench", password_hash="bench")) for i in range(users))
+        await client.post("/users/bulk", content=body,
+                          headers={**headers, "content-type": "application/x-ndjson"})
+
+        async def big() -> float:
+            start = time.perf_counter()
+            await client.get("/users", headers=headers)
+            return time.perf_counter() - start
+
+        async def small() -> list:
+            latencies = []
+            for _ in range(small_requests):
+                start = time.perf_counter()
+                await client.get("/plannings", headers=headers)
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        results = await asyncio.gather(*[big() for _ in range(big_requests)], small())
+        latencies = sorted(results[-1])
+        return dict(
+            big=max(results[:-1]),
+            p50=statistics.median(latencies),
+            p95=latencies[int(len(latencies) * 0.95) - 1],
+            max=latencies[-1],
+        )
+
+
+def run(threadpool_size: int, users: int, big_requests: int, small_requests: int) -> dict:
+    work = tempfile.mkdtemp()
+    os.makedirs(os.path.join(work, "db"))
+    shutil.copy(os.path.join(APP_DIR, "db", "companyplus.db"),
+                os.path.join(work, "db", "companyplus.db"))
+    env = dict(os.environ, PYTHONPATH=APP_DIR, THREADPOOL_SIZE=str(threadpool_size))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(PORT), "--log-level", "warning"],
+        cwd=work, env=env)
+    try:
+        return asyncio.run(measure(users, big_requests, small_requests))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--big-requests", type=int, default=2)
+    parser.add_argument("--small-requests", type=int, default=20)
+    parser.add_argument("--threadpool-sizes", default="1,30")
+    args = parser.parse_args()
+
+    print("THREADPOOL_SIZE | big listing | small p50 | small p95 | small max")
+    for size in [int(size) for size in args.threadpool_sizes.split(",")]:
+        result = run(size, args.users, args.big_requests, args.small_requests)
+        print(f"{size:15} | {result['big']:9.2f}s | {result['p50'] * 1000:7.0f}ms"
+              f" | {result['p95'] * 1000:7.0f}ms | {result['max'] * 1000:7.0f}ms")
@@ -0,0 +1,81 @@
+"""
+Payload size and encode / decode time of a GET /events response
+in JSON and in MessagePack (NegotiatedResponse of internals/responses.py).
+
+    python bench/encoding.py --events 10000 --attendees 5
+"""
+# System Imports
+import argparse
+import json
+import os
+import sys
+import timeit
+# Libs Imports
+import msgpack
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+from internals.responses import NegotiatedResponse, _msgpack_media_type  # noqa: E402
+
+
+def events_payload(events: int, attendees: int) -> list:
+    """
+    Content of GET /events, shaped like models.event.Event
+    """
+    return [
+        dict(
+            id=i,
+            name=f"event {i}",
+            place="meeting room",
+            start_date=1700000000 + i * 3600,
+            end_date=1700001800 + i * 3600,
+            planning_id=1,
+            users=[
+                dict(id=j, first_name=f"first {j}", last_name=f"last {j}",
+                     email=f"user{j}@companyplus.com", role="USER", accepted=j % 2 == 0,
+                     added_at=1700000000, accepted_at=None)
+                for j in range(attendees)
+            ],
+            owner_id=1,
+            company_id=1,
+            created_at=1700000000,
+            updated_at=1700000000,
+        )
+        for i in range(events)
+    ]
+
+
+def best(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def render(content, media_type: str = None) -> bytes:
+    token = _msgpack_media_type.set(media_type)
+    try:
+        return NegotiatedResponse(content).body
+    finally:
+        _msgpack_media_type.reset(token)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--attendees", type=int, default=5)
+    parser.add_argument("--number", type=int, default=5)
+    args = parser.parse_args()
+
+    content = events_payload(args.events, args.attendees)
+    json_body = render(content)
+    msgpack_body = render(content, "application/msgpack")
+    assert msgpack.unpackb(msgpack_body) == orjson.loads(json_body)
+
+    print("format          | size       | encode   | decode")
+    for name, media_type, body, decode in [
+        ("JSON (orjson)", None, json_body, orjson.loads),
+        ("MessagePack", "application/msgpack", msgpack_body, msgpack.unpackb),
+    ]:
+        encode_time = best(lambda: render(content, media_type), args.number)
+        decode_time = best(lambda: decode(body), args.number)
+        print(f"{name:15} | {len(body):8} B | {encode_time * 1000:6.1f}ms | {decode_time * 1000:6.1f}ms")
+    decode_time = best(lambda: json.loads(json_body), args.number)
+    print(f"{'JSON (stdlib)':15} | {len(json_body):8} B |        - | {decode_time * 1000:6.1f}ms")
@@ -0,0 +1,47 @@
+# System Imports
+import os
+import shutil
+import sys
+# Libs Imports
+import pytest
+from fastapi.testclient import TestClient
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory) -> TestClient:
+    """
+    Client of the app, on a copy of the default database
+    """
+    work = tmp_path_factory.mktemp("app")
+    os.makedirs(work / "db")
+    shutil.copy(os.path.join(APP_DIR, "db", "companyplus.db"),
+                work / "db" / "companyplus.db")
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{work}/db/companyplus.db"
+    sys.path.insert(0, APP_DIR)
+    import main
+    return TestClient(main.app)
+
+
+def login(client: TestClient, email: str, password: str) -> dict:
+    response = client.post(
+        "/login", data={"username": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+
+@pytest.fixture(scope="session")
+def jules(client) -> dict:
+    """
+    Headers of an ADMIN of the company 1
+    """
+    return login(client, "jules@ju.ju", "azerty")
+
+
+@pytest.fixture(scope="session")
+def admin(client) -> dict:
+    """
+    Headers of the MAINTAINER
+    """
+    return login(client, "admin@cp.cp", "admin")
@@ -0,0 +1,32 @@
+def test_attendees_added_concurrently_are_reported(client, jules, monkeypatch):
+    import datetime
+    from db.database import SessionLocal
+    from entities import UserEvent as UserEventEntity
+    from routers import event
+
+    response = client.post("/event", headers=jules, json=dict(
+        name="concurrent", place="room", planning_id=1,
+        start_date=1800000000, end_date=1800001800))
+    assert response.status_code == 201, response.text
+    event_id = response.json()["id"]
+    get_attendee_candidates = event.get_attendee_candidates
+
+    def add_concurrently(db, eventId, user_ids, authUser):
+        candidates = get_attendee_candidates(db, eventId, user_ids, authUser)
+        # another request adds the user between the lookup and the insert
+        other = SessionLocal()
+        other.add(UserEventEntity(user_id=1, event_id=eventId,
+                                  added_at=datetime.datetime.utcnow()))
+        other.commit()
+        other.close()
+        return candidates
+
+    monkeypatch.setattr(event, "get_attendee_candidates", add_concurrently)
+    response = client.post(f"/event/{event_id}/attendees",
+                           headers=jules, json=dict(user_ids=[1, 3]))
+    assert response.status_code == 200, response.text
+    assert response.json()["changed"] == 1
+    assert response.json()["results"] == [
+        dict(user_id=1, status="already_in_event"),
+        dict(user_id=3, status="added"),
+    ]
@@ -0,0 +1,53 @@
+# Libs Imports
+from sqlalchemy import event
+
+
+def count_statements(client, path: str, headers: dict) -> int:
+    """
+    Number of SQL statements run to answer GET path
+    """
+    from db.database import engine
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get(path, headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert response.status_code == 200, response.text
+    return len(statements)
+
+
+def create_event(client, headers: dict, planning_id: int, i: int):
+    response = client.post("/event", headers=headers, json=dict(
+        name=f"event {i}", place="room", planning_id=planning_id,
+        start_date=1700000000 + i * 3600, end_date=1700001800 + i * 3600))
+    assert response.status_code == 201, response.text
+    response = client.post(f"/event/{response.json()['id']}/attendees",
+                           headers=headers, json=dict(user_ids=[3]))
+    assert response.status_code == 200, response.text
+
+
+def test_get_events_statements_dont_grow_with_events(client, jules):
+    response = client.post("/planning", headers=jules,
+                           json=dict(name="statements"))
+    assert response.status_code == 201, response.text
+    path = f"/events?planning_id={response.json()['id']}"
+
+    create_event(client, jules, response.json()["id"], 0)
+    client.get(path, headers=jules)
+    one_event = count_statements(client, path, jules)
+
+    for i in range(1, 25):
+        create_event(client, jules, response.json()["id"], i)
+    client.get(path, headers=jules)
+    many_events = count_statements(client, path, jules)
+
+    events = client.get(path, headers=jules).json()
+    assert len(events) == 25
+    assert all(len(event["users"]) == 2 for event in events)
+    assert many_events == one_event
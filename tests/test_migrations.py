@@ -0,0 +1,46 @@
+# System Imports
+import os
+import shutil
+import sqlite3
+# Libs Imports
+import pytest
+# Local Imports
+from tests.conftest import APP_DIR
+
+
+def test_upgrade_fails_on_emails_differing_by_case(client, tmp_path):
+    from crypt import encrypt
+    from db.database import Base, create_db_engine
+    from db.migrations import upgrade
+
+    path = tmp_path / "companyplus.db"
+    shutil.copy(os.path.join(APP_DIR, "db", "companyplus.db"), path)
+    connection = sqlite3.connect(path)
+    connection.execute("INSERT INTO users (first_name, last_name, email, role) VALUES (?, ?, ?, 'USER')",
+                       (encrypt("jules"), encrypt("bis"), encrypt(" Jules@JU.ju")))
+    connection.commit()
+    connection.close()
+
+    engine = create_db_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with pytest.raises(RuntimeError, match=r"\(user ids\): 2, 8$"):
+        upgrade(engine)
+
+
+def test_upgrade_keeps_the_updated_at_of_the_users(client, tmp_path):
+    from db.database import Base, create_db_engine
+    from db.migrations import upgrade
+
+    path = tmp_path / "companyplus.db"
+    shutil.copy(os.path.join(APP_DIR, "db", "companyplus.db"), path)
+    connection = sqlite3.connect(path)
+    before = connection.execute("SELECT id, updated_at FROM users ORDER BY id").fetchall()
+
+    engine = create_db_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+    engine.dispose()
+
+    assert connection.execute("SELECT id, updated_at FROM users ORDER BY id").fetchall() == before
+    assert connection.execute("SELECT COUNT(*) FROM users WHERE email_index IS NULL").fetchone() == (0,)
+    connection.close()
@@ -0,0 +1,31 @@
+# Libs Imports
+import msgpack
+import pytest
+
+
+@pytest.mark.parametrize("accept, media_type", [
+    ("application/msgpack", "application/msgpack"),
+    ("application/x-msgpack", "application/x-msgpack"),
+    ("application/json;q=0.5, application/msgpack", "application/msgpack"),
+    ("application/msgpack;q=0", "application/json"),
+    ("application/json, application/msgpack;q=0.1", "application/json"),
+    ("*/*", "application/json"),
+    ("", "application/json"),
+])
+def test_content_negotiation_honours_q(client, jules, accept, media_type):
+    response = client.get("/plannings", headers={**jules, "Accept": accept})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == media_type
+    assert response.headers["vary"] == "Accept"
+    if media_type != "application/json":
+        assert msgpack.unpackb(response.content) == client.get("/plannings", headers=jules).json()
+
+
+def test_not_modified_varies_on_accept(client, jules):
+    headers = {**jules, "Accept": "application/msgpack"}
+    etag = client.get("/plannings", headers=headers).headers["etag"]
+    response = client.get("/plannings", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["vary"] == "Accept"
+    # the JSON variant has its own ETag
+    assert client.get("/plannings", headers={**jules, "If-None-Match": etag}).status_code == 200
@@ -0,0 +1,40 @@
+# System Imports
+import datetime
+
+
+def test_event_moved_to_another_company_is_synced(client, admin, jules):
+    response = client.post("/event", headers=jules, json=dict(
+        name="moved", place="room", planning_id=1,
+        start_date=2000000000, end_date=2000001800))
+    assert response.status_code == 201, response.text
+    event_id = response.json()["id"]
+    response = client.post(f"/event/{event_id}/attendees",
+                           headers=jules, json=dict(user_ids=[3]))
+    assert response.status_code == 200, response.text
+    user_event_ids = {
+        user_event["id"] for user_event in client.get("/sync", headers=jules).json()["user_event"]
+        if user_event["event_id"] == event_id}
+    assert len(user_event_ids) == 2
+    # attendees synced long ago, older than the token
+    from db.database import SessionLocal
+    from entities import UserEvent as UserEventEntity
+    db = SessionLocal()
+    db.query(UserEventEntity).filter(UserEventEntity.id.in_(user_event_ids)).update(
+        {UserEventEntity.updated_at: datetime.datetime(2020, 1, 1)}, synchronize_session=False)
+    db.commit()
+    db.close()
+    token = client.get("/sync", headers=jules).json()["token"]
+
+    # planning 3 is of the company 2
+    response = client.patch(f"/event/{event_id}", headers=admin, json=dict(planning_id=3))
+    assert response.status_code == 200, response.text
+
+    changes = client.get("/sync", params=dict(since=token), headers=jules).json()
+    assert event_id not in [event["id"] for event in changes["events"]]
+    deleted = {(deletion["entity"], deletion["id"]) for deletion in changes["deleted"]}
+    assert ("events", event_id) in deleted
+    assert {("user_event", id) for id in user_event_ids} <= deleted
+
+    changes = client.get("/sync", params=dict(since=token), headers=admin).json()
+    assert event_id in [event["id"] for event in changes["events"]]
+    assert user_event_ids <= {user_event["id"] for user_event in changes["user_event"]}
@@ -0,0 +1,53 @@
+def etag(client, path: str, headers: dict) -> str:
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.headers["etag"]
+
+
+def test_etags_follow_the_changes_of_their_tenant(client, admin, jules):
+    maintainer = etag(client, "/plannings", admin)
+    company = etag(client, "/plannings", jules)
+
+    # change of another company (the first one of that company)
+    response = client.post("/company", headers=admin, json=dict(
+        name="versioning", city="Lyon", country="France"))
+    assert response.status_code == 201, response.text
+    after_create = etag(client, "/plannings", admin)
+    response = client.post("/planning", headers=admin, json=dict(
+        name="versioning", company_id=response.json()["id"]))
+    assert response.status_code == 201, response.text
+
+    assert etag(client, "/plannings", jules) == company
+    assert after_create != maintainer
+    assert etag(client, "/plannings", admin) != after_create
+
+    # change of the company
+    response = client.post("/planning", headers=jules, json=dict(name="versioning 1"))
+    assert response.status_code == 201, response.text
+    assert etag(client, "/plannings", jules) != company
+
+
+def test_events_etag_follows_attendees_of_other_companies(client, admin, jules):
+    response = client.post("/event", headers=jules, json=dict(
+        name="attendees", place="room", planning_id=1,
+        start_date=1900000000, end_date=1900001800))
+    assert response.status_code == 201, response.text
+    # users of the companies 2 and 3, added by the MAINTAINER
+    response = client.post(f"/event/{response.json()['id']}/attendees",
+                           headers=admin, json=dict(user_ids=[4, 6]))
+    assert response.status_code == 200, response.text
+    assert response.json()["changed"] == 2
+
+    before = etag(client, "/events", jules)
+    response = client.patch("/users/4", headers=admin, json=dict(first_name="RENAMED"))
+    assert response.status_code == 200, response.text
+    response = client.get("/events", headers={**jules, "If-None-Match": before})
+    assert response.status_code == 200
+    assert "RENAMED" in [user["first_name"] for event in response.json() for user in event["users"]]
+
+    before = response.headers["etag"]
+    response = client.delete("/users/6", headers=admin)
+    assert response.status_code == 200, response.text
+    response = client.get("/events", headers={**jules, "If-None-Match": before})
+    assert response.status_code == 200
+    assert 6 not in [user["id"] for event in response.json() for user in event["users"]]